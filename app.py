@@ -3,55 +3,173 @@ FastAPI web application for managing prompts and generating EPD images.
 """
 
 import os
+import asyncio
 import logging
-import threading
 import atexit
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List
-import csv
+from typing import Any, Callable, Dict, Optional, Set
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from core import generate_and_display_image
-from image_utils import log_prompt_to_csv
-
-app = FastAPI(title="E-Paper Display Image Generator")
+from apscheduler.triggers.interval import IntervalTrigger
+from core import (generate_and_display_image_async, display_prefetched_frame,
+                  prefetch_frames_async, get_prefetch_queue)
+import dithering
+from gemini_client import get_client_stats
+from job_queue import Job, JobQueue, PRIORITY_MANUAL, PRIORITY_SCHEDULED
+from page_template import PageTemplate, choose_encoding, etag_matches
+from pipeline_stats import add_stage_listener, get_stage_stats
+from prompt_history import get_prompt_history
+
+# Event loop serving the app; the scheduler thread hands work to it
+event_loop: Optional[asyncio.AbstractEventLoop] = None
+# Background fill of the prefetch queue
+prefetch_task: Optional[asyncio.Task] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    manager.start()
+    config = build_config()
+    await asyncio.to_thread(dithering.warm_palette_lut, config['dither'], config['dither_strength'])
+    worker = job_queue.start()
+    start_prefetch()
+    yield
+    worker.cancel()
+
+
+app = FastAPI(title="E-Paper Display Image Generator", lifespan=lifespan)
 load_dotenv()
 
-# Global state for task tracking
-current_task = {
-    'status': 'idle',  # idle, running, complete, error
-    'message': 'Ready',
-    'image_path': None,
-    'error': None
-}
-task_lock = threading.Lock()
+class _Client:
+    """Outbound queue and sender task of one WebSocket connection."""
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.sender: Optional[asyncio.Task] = None
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    """
+    WebSocket clients with per-client delivery.
+
+    Every client has a bounded outbound queue drained by its own sender
+    task, so a stalled client never delays the others. A client whose queue
+    overflows, whose send exceeds the timeout, or whose send fails is
+    disconnected.
+    """
+
+    def __init__(self, send_timeout: float = 5.0, queue_size: int = 32):
+        """
+        Initialize connection manager.
+
+        Args:
+            send_timeout: Seconds a single send may take before the client is evicted
+            queue_size: Messages queued per client before it is evicted as too slow
+        """
+        self.send_timeout = send_timeout
+        self.queue_size = queue_size
+        self._clients: Dict[WebSocket, _Client] = {}
+        # Strong references keep pending closes from being garbage-collected
+        self._closing: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {'connections': 0, 'disconnects': 0, 'evicted_slow': 0, 'evicted_failed': 0,
+                       'messages_sent': 0, 'messages_dropped': 0}
+
+    def start(self):
+        """Bind to the running event loop; publish() is a no-op before this."""
+        self._loop = asyncio.get_running_loop()
+
+    def publish(self, message: dict):
+        """Queue a message for all clients; safe to call from any thread."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            # Always go through the loop so messages keep their order
+            loop.call_soon_threadsafe(self.broadcast, message)
+        except RuntimeError:
+            pass  # Loop closed during shutdown
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = _Client(websocket, self.queue_size)
+        client.sender = asyncio.get_running_loop().create_task(self._send_loop(client))
+        self._clients[websocket] = client
+        self._stats['connections'] += 1
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
+        client = self._clients.pop(websocket, None)
+        if client is not None:
+            client.sender.cancel()
+            self._stats['disconnects'] += 1
+
+    def send(self, websocket: WebSocket, message: dict):
+        """Queue a message for one client; call from the event loop."""
+        client = self._clients.get(websocket)
+        if client is None:
+            return
+        try:
+            client.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._stats['messages_dropped'] += client.queue.qsize() + 1
+            self._evict(client, 'evicted_slow', f"{self.queue_size} messages behind")
+
+    def broadcast(self, message: dict):
+        """Queue a message for every client; call from the event loop."""
+        for websocket in list(self._clients):
+            self.send(websocket, message)
+
+    async def _send_loop(self, client: _Client):
+        while True:
+            message = await client.queue.get()
             try:
-                await connection.send_json(message)
-            except:
-                pass
-
-manager = ConnectionManager()
+                await asyncio.wait_for(client.websocket.send_json(message), self.send_timeout)
+            except asyncio.TimeoutError:
+                self._stats['messages_dropped'] += client.queue.qsize() + 1
+                self._evict(client, 'evicted_slow', f"send took over {self.send_timeout:g} s")
+                return
+            except Exception as e:
+                self._stats['messages_dropped'] += client.queue.qsize() + 1
+                self._evict(client, 'evicted_failed', f"send failed: {type(e).__name__}")
+                return
+            self._stats['messages_sent'] += 1
+
+    def _evict(self, client: _Client, reason: str, detail: str):
+        if self._clients.pop(client.websocket, None) is None:
+            return
+        logger.warning(f"Disconnecting WebSocket client: {detail}")
+        self._stats[reason] += 1
+        client.sender.cancel()
+        # Closing can block on a stalled peer too, so it gets the same deadline
+        task = asyncio.get_running_loop().create_task(self._close(client.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=1013), self.send_timeout)
+        except Exception:
+            pass
+
+    def get_stats(self) -> dict:
+        """Connected clients and connection, eviction and message counts."""
+        return dict(self._stats, clients=len(self._clients))
+
+
+manager = ConnectionManager(
+    send_timeout=float(os.getenv('WS_SEND_TIMEOUT', '5')),
+    queue_size=int(os.getenv('WS_QUEUE_SIZE', '32')))
+# Push stage transitions of every pipeline run to the web clients
+add_stage_listener(lambda event: manager.publish(dict(event, type='stage')))
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -60,7 +178,7 @@ logging.basicConfig(
 )
 
 PROMPT_FILE = Path(__file__).parent / 'prompt.md'
-PROMPT_HISTORY_FILE = Path(__file__).parent / 'prompt_history.csv'
+INDEX_TEMPLATE = PageTemplate(str(Path(__file__).parent / 'templates' / 'index.html'))
 
 
 # Pydantic models
@@ -80,63 +198,152 @@ def write_prompt(prompt: str):
     PROMPT_FILE.write_text(prompt, encoding='utf-8')
 
 
-def update_task_status(status: str, message: str, **kwargs):
-    """Thread-safe task status update."""
-    with task_lock:
-        current_task['status'] = status
-        current_task['message'] = message
-        current_task.update(kwargs)
+def build_config() -> dict:
+    """Build generation configuration from environment."""
+    return {
+        'api_key': os.getenv('GEMINI_API_KEY'),
+        'model': os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-image'),
+        'width': int(os.getenv('EPD_WIDTH', '800')),
+        'height': int(os.getenv('EPD_HEIGHT', '480')),
+        'image_dir': os.getenv('IMAGE_DIR', 'generated_images'),
+        'archive_format': os.getenv('ARCHIVE_FORMAT', 'png').lower(),
+        'archive_compress_level': int(os.getenv('ARCHIVE_COMPRESS_LEVEL', '6')),
+        'dither': os.getenv('EPD_DITHER', 'pil'),
+        'dither_strength': float(os.getenv('EPD_DITHER_STRENGTH', '1.0')),
+        'dither_serpentine': os.getenv('EPD_DITHER_SERPENTINE', 'false').lower() == 'true',
+        'frame_cache_dir': os.getenv('FRAME_CACHE_DIR'),
+        'frame_cache_size': int(os.getenv('FRAME_CACHE_SIZE', '200')),
+        'early_wake': os.getenv('EPD_EARLY_WAKE', 'true').lower() == 'true',
+        'prompt_cache_ttl': float(os.getenv('PROMPT_CACHE_TTL', '0')),
+        'prompt_cache_size': int(os.getenv('PROMPT_CACHE_SIZE', '50')),
+        'prompt_cache_dir': os.getenv('PROMPT_CACHE_DIR'),
+        'prefetch_count': int(os.getenv('PREFETCH_COUNT', '0')),
+        'prefetch_dir': os.getenv('PREFETCH_DIR')
+    }
+
 
+async def run_generation(job: Job, progress: Callable[[str], None]) -> Dict[str, Any]:
+    """
+    Job runner for image generation.
 
-def run_generation():
-    """Background task for image generation."""
-    update_task_status('running', 'Starting generation...')
+    Args:
+        job: Job whose params hold use_prefetched (show a prefetched frame
+            if one is queued instead of generating live, for scheduled
+            runs) and force_fresh (call Gemini even if the prompt cache has
+            an image)
+        progress: Status callback of the job
 
+    Returns:
+        Result dict of the core pipeline
+    """
+    use_prefetched = job.params.get('use_prefetched', False)
     try:
         prompt = read_prompt()
+        config = build_config()
+        config['force_fresh'] = job.params.get('force_fresh', False)
+
+        result = None
+        if use_prefetched:
+            result = await asyncio.to_thread(display_prefetched_frame, prompt, config, progress)
+        if result is None:
+            result = await generate_and_display_image_async(prompt, config, progress)
+        return result
+
+    finally:
+        if use_prefetched:
+            start_prefetch()
+
+
+def current_status() -> Dict[str, Any]:
+    """
+    Status of the running job, else of the last finished one.
+
+    Keeps the fields of the single-task status ('status', 'message',
+    'image_path', ...) and adds the job id and the number of queued jobs.
+    """
+    status = {
+        'status': 'idle',  # idle, running, complete, error, cancelled
+        'message': 'Ready',
+        'job_id': None,
+        'image_path': None,
+        'refresh_skipped': False,
+        'fallback': False,
+        'stages': None,
+        'total_ms': None,
+        'error': None
+    }
+    job = job_queue.running() or next(iter(job_queue.finished()), None)
+    if job is not None:
+        result = job.result or {}
+        status.update(status=job.status, message=job.message, job_id=job.id,
+                      image_path=result.get('image_path'),
+                      refresh_skipped=result.get('refresh_skipped', False),
+                      fallback=result.get('fallback', False),
+                      stages=result.get('stages'),
+                      total_ms=result.get('total_ms'),
+                      error=result.get('error'))
+    status['queued'] = len(job_queue.queued())
+    return status
+
+
+def publish_job(job: Job):
+    """Push a job change and the resulting overall status to WebSocket clients."""
+    manager.publish(dict(job.snapshot(), type='job'))
+    manager.publish(dict(current_status(), type='status'))
+
 
-        # Build configuration from environment
-        config = {
-            'api_key': os.getenv('GEMINI_API_KEY'),
-            'model': os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-image'),
-            'width': int(os.getenv('EPD_WIDTH', '800')),
-            'height': int(os.getenv('EPD_HEIGHT', '480')),
-            'image_dir': os.getenv('IMAGE_DIR', 'generated_images')
-        }
-
-        # Status callback to update progress
-        def status_callback(msg: str):
-            update_task_status('running', msg)
-
-        # Run generation
-        result = generate_and_display_image(prompt, config, status_callback)
-
-        if result['success']:
-            update_task_status('complete', result['message'],
-                             image_path=result.get('image_path'))
-        else:
-            update_task_status('error', result['message'],
-                             error=result.get('error'))
+job_queue = JobQueue(run_generation, on_change=publish_job)
 
+
+async def run_prefetch():
+    """Event loop task that refills the prefetch queue."""
+    try:
+        added = await prefetch_frames_async(read_prompt(), build_config())
+        if added:
+            logger.info(f"Prefetched {added} frame(s)")
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        logger.error(f"Generation thread error: {e}", exc_info=True)
-        update_task_status('error', f'Unexpected error: {str(e)}', error=str(e))
+        # The next refill attempt retries; scheduled runs fall back to live generation
+        logger.warning(f"Prefetch failed: {type(e).__name__}: {e}")
+
+
+def start_prefetch():
+    """Start refilling the prefetch queue unless disabled, full or already running."""
+    global prefetch_task
+    if prefetch_task is not None and not prefetch_task.done():
+        return
+    queue = get_prefetch_queue(build_config())
+    if queue is None or queue.is_full():
+        return
+    prefetch_task = asyncio.get_running_loop().create_task(run_prefetch())
+
+
+def submit_scheduled_generation():
+    """Queue the scheduled generation; runs on the event loop."""
+    job, coalesced = job_queue.submit('scheduled', PRIORITY_SCHEDULED,
+                                      {'use_prefetched': True, 'force_fresh': False})
+    if coalesced:
+        logger.info(f"Scheduled generation already queued as job {job.id}")
 
 
 def scheduled_generation():
     """Run scheduled image generation at configured time."""
     logger.info("Starting scheduled image generation...")
 
-    # Check if already running
-    with task_lock:
-        if current_task['status'] == 'running':
-            logger.warning("Generation already in progress, skipping scheduled run")
-            return
+    if event_loop is None or event_loop.is_closed():
+        logger.warning("Web app event loop not running, skipping scheduled run")
+        return
+
+    # The scheduler runs in its own thread; hand the job to the event loop
+    event_loop.call_soon_threadsafe(submit_scheduled_generation)
+
 
-    # Start generation in background thread
-    thread = threading.Thread(target=run_generation)
-    thread.daemon = True
-    thread.start()
+def scheduled_prefetch():
+    """Periodically top up the prefetch queue, retrying failed refills."""
+    if event_loop is None or event_loop.is_closed():
+        return
+    event_loop.call_soon_threadsafe(start_prefetch)
 
 
 # Initialize scheduler
@@ -156,6 +363,14 @@ if auto_generate:
             name='Daily image generation',
             replace_existing=True
         )
+        if int(os.getenv('PREFETCH_COUNT', '0')) > 0:
+            scheduler.add_job(
+                func=scheduled_prefetch,
+                trigger=IntervalTrigger(minutes=int(os.getenv('PREFETCH_INTERVAL', '30'))),
+                id='prefetch_refill',
+                name='Prefetch queue refill',
+                replace_existing=True
+            )
         scheduler.start()
         logger.info(f"Scheduled daily generation at {schedule_time}")
 
@@ -168,22 +383,22 @@ else:
 
 
 @app.get("/", response_class=HTMLResponse)
-async def index():
-    """Main page."""
-    prompt = read_prompt()
-    with task_lock:
-        status = current_task.copy()
-
-    # Read and render HTML template
-    template_path = Path(__file__).parent / 'templates' / 'index.html'
-    html_content = template_path.read_text(encoding='utf-8')
-
-    # Simple template rendering (replace placeholders)
-    html_content = html_content.replace('{{ prompt }}', prompt)
-    html_content = html_content.replace('{{ status.status }}', status['status'])
-    html_content = html_content.replace('{{ status.message }}', status['message'])
-
-    return html_content
+async def index(request: Request):
+    """Main page, with ETag revalidation and gzip/brotli compression."""
+    status = current_status()
+    page = INDEX_TEMPLATE.render({
+        'prompt': read_prompt(),
+        'status.status': status['status'],
+        'status.message': status['message'],
+    })
+
+    encoding = choose_encoding(request.headers.get('accept-encoding'))
+    headers = {'ETag': page.etag_for(encoding), 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return HTMLResponse(page.encode(encoding), headers=headers)
 
 
 @app.post("/save-prompt")
@@ -199,11 +414,11 @@ async def save_prompt(request: PromptRequest):
             raise HTTPException(status_code=400, detail="Prompt too long (max 1000 characters)")
 
         write_prompt(prompt)
-        log_prompt_to_csv(prompt)
+        await asyncio.to_thread(get_prompt_history().add, prompt)
         logger.info(f"Prompt saved: {prompt[:50]}...")
 
         # Broadcast to all connected WebSocket clients
-        await manager.broadcast({'type': 'prompt_updated', 'prompt': prompt})
+        manager.publish({'type': 'prompt_updated', 'prompt': prompt})
 
         return {"success": True, "message": "Prompt saved successfully"}
 
@@ -215,55 +430,99 @@ async def save_prompt(request: PromptRequest):
 
 
 @app.get("/prompt-history")
-async def get_prompt_history(limit: int = 3):
-    """Get the last N prompts from history."""
-    prompts = []
-    if PROMPT_HISTORY_FILE.exists():
-        with open(PROMPT_HISTORY_FILE, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-            for row in reversed(rows[-limit:]):
-                prompts.append({'timestamp': row['timestamp'], 'prompt': row['prompt']})
-    return {"prompts": prompts}
+async def get_prompt_history_endpoint(limit: int = 3, offset: int = 0, q: Optional[str] = None):
+    """Get prompts from history, newest first; ?q= filters by text."""
+    limit = max(1, min(limit, 100))
+    entries = await asyncio.to_thread(get_prompt_history().recent, limit=limit, offset=offset, search=q)
+    return {"prompts": entries}
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
+    # Current state first; later changes are pushed as they happen
+    manager.send(websocket, dict(current_status(), type='status'))
     try:
         while True:
             await websocket.receive_text()
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the socket was closed by an eviction
+        pass
+    finally:
         manager.disconnect(websocket)
 
 
-@app.post("/generate")
-async def generate():
-    """Start image generation."""
-    with task_lock:
-        if current_task['status'] == 'running':
-            raise HTTPException(status_code=409, detail="Generation already in progress")
+@app.post("/generate", status_code=202)
+async def generate(fresh: bool = False):
+    """Queue image generation; ?fresh=true bypasses the prompt cache."""
+    job, coalesced = job_queue.submit('manual', PRIORITY_MANUAL,
+                                      {'use_prefetched': False, 'force_fresh': fresh})
+    return {
+        "status": job.status,
+        "job_id": job.id,
+        "coalesced": coalesced,
+        "message": "Joined an identical queued generation" if coalesced else "Generation queued"
+    }
+
+
+@app.post("/cancel")
+async def cancel():
+    """Cancel the running image generation."""
+    job = job_queue.running()
+    if job is None:
+        raise HTTPException(status_code=409, detail="No generation in progress")
+
+    job_queue.cancel(job.id)
+    return {"status": "cancelling", "job_id": job.id, "message": "Cancellation requested"}
+
+
+@app.get("/jobs")
+async def list_jobs():
+    """Running, queued (in run order) and recently finished jobs."""
+    running = job_queue.running()
+    return {
+        "running": running.snapshot() if running else None,
+        "queued": [job.snapshot() for job in job_queue.queued()],
+        "finished": [job.snapshot() for job in job_queue.finished()]
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status and, once finished, result of a job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job.snapshot()
 
-    # Start background thread
-    thread = threading.Thread(target=run_generation)
-    thread.daemon = True
-    thread.start()
 
-    return {"status": "started", "message": "Generation started"}
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job."""
+    if job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if not job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job already finished")
+    return {"status": "cancelling", "job_id": job_id, "message": "Cancellation requested"}
 
 
 @app.get("/status")
 async def status():
     """Get current generation status."""
-    with task_lock:
-        return current_task.copy()
+    status = current_status()
+    status['gemini'] = get_client_stats()
+    status['pipeline'] = get_stage_stats()
+    queue = get_prefetch_queue(build_config())
+    status['prefetch'] = {'queued': len(queue), 'capacity': queue.capacity} if queue else None
+    status['websocket'] = manager.get_stats()
+    return status
 
 
 @app.get("/scheduler-status")
 async def scheduler_status():
     """Get scheduler configuration and status."""
-    jobs = scheduler.get_jobs()
-    next_run = jobs[0].next_run_time.isoformat() if jobs else None
+    job = scheduler.get_job('daily_generation')
+    next_run = job.next_run_time.isoformat() if job and job.next_run_time else None
 
     return {
         "enabled": auto_generate,
@@ -0,0 +1,93 @@
+"""
+Background writer for archival copies of generated images.
+
+Encoding a full-resolution PNG is slow on a Pi, so originals are written
+by a single worker thread while the pipeline resizes, quantizes and
+refreshes the panel. The number of pending writes is bounded; submitting
+beyond that blocks until a slot frees up.
+"""
+
+import os
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from PIL import Image
+from image_utils import save_image_with_timestamp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PENDING = 2
+
+
+class ArchiveWriter:
+    """Single-threaded image writer with a bounded number of pending jobs."""
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING):
+        """
+        Initialize archive writer.
+
+        Args:
+            max_pending: Writes queued or in progress before submit() blocks
+        """
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive-writer')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, image: Image.Image, directory: str, image_format: str = 'png',
+               compress_level: int = 6) -> 'Future[str]':
+        """
+        Queue an image to be saved with a timestamped name.
+
+        The image must not be modified until the returned future completes.
+
+        Args:
+            image: Loaded PIL Image
+            directory: Target directory
+            image_format: 'png' or 'webp' (lossless)
+            compress_level: zlib level for PNG, 0-9
+
+        Returns:
+            Future resolving to the absolute path of the written file
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, image, directory, image_format, compress_level)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    @staticmethod
+    def _write(image: Image.Image, directory: str, image_format: str, compress_level: int) -> str:
+        start = time.monotonic()
+        path = save_image_with_timestamp(image, directory=directory, image_format=image_format,
+                                         compress_level=compress_level)
+        logger.info(f"Archived {os.path.basename(path)} in {(time.monotonic() - start) * 1000:.0f} ms")
+        return path
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting writes; by default wait for pending ones to finish."""
+        self._executor.shutdown(wait=wait)
+
+
+_writer: Optional[ArchiveWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_archive_writer() -> ArchiveWriter:
+    """
+    Return the process-wide archive writer, creating it on first use.
+
+    The pending write limit is read from ARCHIVE_QUEUE_SIZE. Pending writes
+    are flushed when the process exits.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            max_pending = int(os.getenv('ARCHIVE_QUEUE_SIZE', str(DEFAULT_MAX_PENDING)))
+            _writer = ArchiveWriter(max_pending=max_pending)
+            atexit.register(_writer.shutdown)
+        return _writer
@@ -0,0 +1,244 @@
+"""
+Microbenchmarks for the EPD image pipeline.
+
+Runs without display hardware. Usage:
+    python benchmark.py [--repeat N]
+"""
+
+import argparse
+import io
+import os
+import random
+import resource
+import subprocess
+import sys
+import timeit
+import numpy as np
+from PIL import Image, ImageFilter
+import dithering
+from image_utils import pack_pixels
+
+EPD_WIDTH = 800
+EPD_HEIGHT = 480
+
+
+def make_test_image(width: int = EPD_WIDTH, height: int = EPD_HEIGHT, seed: int = 0) -> Image.Image:
+    """Build a deterministic noisy RGB image so quantization does real work."""
+    rng = random.Random(seed)
+    return Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+
+
+def make_gradient_image(width: int = EPD_WIDTH, height: int = EPD_HEIGHT) -> Image.Image:
+    """Smooth hue/brightness sweep, a fair target for judging dither quality."""
+    x = np.linspace(0, 1, width)[None, :]
+    y = np.linspace(0, 1, height)[:, None]
+    rgb = np.stack([np.broadcast_to(x, (height, width)),
+                    np.broadcast_to(1 - x * y, (height, width)),
+                    np.broadcast_to(y * 0.5, (height, width))], axis=-1)
+    return Image.fromarray((rgb * 255).astype(np.uint8), "RGB")
+
+
+def perceptual_rmse(source: Image.Image, codes: bytes) -> float:
+    """RMSE between source and dithered result after a blur approximating viewing distance."""
+    rendered = dithering.PALETTE[np.frombuffer(codes, dtype=np.uint8)].reshape(source.height, source.width, 3)
+    rendered = Image.fromarray(rendered.astype(np.uint8), "RGB")
+    blur = ImageFilter.GaussianBlur(1.5)
+    a = np.asarray(source.convert("RGB").filter(blur), dtype=np.float32)
+    b = np.asarray(rendered.filter(blur), dtype=np.float32)
+    return float(np.sqrt(np.mean((a - b) ** 2)))
+
+
+def quantize_4color(image: Image.Image) -> bytes:
+    """Quantize to the panel palette exactly like EPD.getbuffer does."""
+    pal_image = Image.new("P", (1, 1))
+    pal_image.putpalette((0, 0, 0, 255, 255, 255, 255, 255, 0, 255, 0, 0) + (0, 0, 0) * 252)
+    return image.convert("RGB").quantize(palette=pal_image).tobytes('raw')
+
+
+def pack_pixels_loop(pixels: bytes) -> list:
+    """Reference implementation: the original per-byte packing loop."""
+    buf = [0x00] * (len(pixels) // 4)
+    idx = 0
+    for i in range(0, len(pixels), 4):
+        buf[idx] = (pixels[i] << 6) + (pixels[i+1] << 4) + (pixels[i+2] << 2) + pixels[i+3]
+        idx += 1
+    return buf
+
+
+def make_response(data: bytes, mime_type: str):
+    """Wrap encoded image bytes in a generate_content response like the API returns."""
+    from google.genai import types
+    return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(
+        role='model', parts=[types.Part(text="Here is your image."),
+                             types.Part(inline_data=types.Blob(data=data, mime_type=mime_type))]))])
+
+
+def extract_image_legacy(response) -> Image.Image:
+    """Reference implementation: the original response decoding path."""
+    for part in response.parts:
+        if part.inline_data is not None:
+            gemini_image = part.as_image()
+            if hasattr(gemini_image, '_pil'):
+                pil_image = gemini_image._pil
+            else:
+                pil_image = Image.open(io.BytesIO(part.inline_data.data))
+            pil_image.load()
+            return pil_image
+    raise ValueError("No image data found in API response")
+
+
+def report(name: str, seconds: list, number: int, extra: str = ""):
+    best = min(seconds) / number * 1000
+    print(f"  {name:<28} {best:10.3f} ms  {extra}".rstrip())
+
+
+def bench_pack(repeat: int):
+    """Compare the legacy packing loop with the vectorized pack_pixels."""
+    pixels = quantize_4color(make_test_image())
+    if bytes(pack_pixels_loop(pixels)) != pack_pixels(pixels):
+        raise AssertionError("pack_pixels output differs from reference loop")
+
+    print(f"pack ({len(pixels)} pixels -> {len(pixels) // 4} bytes)")
+    report("loop", timeit.repeat(lambda: pack_pixels_loop(pixels), repeat=repeat, number=1), 1)
+    report("numpy", timeit.repeat(lambda: pack_pixels(pixels), repeat=repeat, number=10), 10)
+
+
+def bench_lut(repeat: int):
+    """Nearest-color search by distance computation vs the palette lookup table."""
+    rgb = np.asarray(make_test_image())
+    start = timeit.default_timer()
+    dithering.palette_lut()
+    print(f"palette lut (load/build {(timeit.default_timer() - start) * 1000:.1f} ms)")
+    if not np.array_equal(dithering.nearest_codes(rgb), dithering.lut_codes(rgb)):
+        raise AssertionError("lut_codes output differs from nearest_codes")
+
+    report("distance", timeit.repeat(lambda: dithering.nearest_codes(rgb), repeat=repeat, number=1), 1)
+    report("lut gather", timeit.repeat(lambda: dithering.lut_codes(rgb), repeat=repeat, number=10), 10)
+
+
+def bench_dither(repeat: int):
+    """Compare dithering modes against the PIL quantize path: speed and quality."""
+    image = make_gradient_image()
+    # One-time setup, not part of the timing
+    dithering.blue_noise_matrix()
+    dithering.palette_lut()
+
+    print("dither (speed, blurred RMSE vs source - lower is better)")
+    cases = [("pil", lambda: quantize_4color(image))]
+    for method in dithering.METHODS:
+        cases.append((method, lambda m=method: dithering.dither(image, m)))
+    for method in dithering.KERNELS:
+        cases.append((f"{method} serpentine", lambda m=method: dithering.dither(image, m, serpentine=True)))
+
+    for name, run in cases:
+        quality = f"rmse {perceptual_rmse(image, run()):6.2f}"
+        report(name, timeit.repeat(run, repeat=repeat, number=1), 1, quality)
+
+
+def bench_display(repeat: int):
+    """Time the full EPD driver path against the virtual panel (no sleeps)."""
+    os.environ['EPD_BACKEND'] = 'virtual'
+    os.environ['EPD_VIRTUAL_TIME_SCALE'] = '0'
+    from epd_color import EPD
+
+    image = make_test_image()
+    epd = EPD()
+
+    def refresh():
+        epd.init()
+        epd.display(epd.getbuffer(image))
+        epd.sleep()
+
+    print("display (virtual panel, Python-side cost only)")
+    report("init+getbuffer+display", timeit.repeat(refresh, repeat=repeat, number=1), 1)
+
+
+def _proc_status_kib(field: str) -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def reset_peak_rss() -> int:
+    """Reset the peak RSS counter (Linux) and return the current RSS in KiB."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _proc_status_kib('VmRSS')
+    except OSError:
+        # Without clear_refs the peak includes start-up (imports)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def peak_rss() -> int:
+    """Peak RSS in KiB since the last reset_peak_rss()."""
+    try:
+        return _proc_status_kib('VmHWM')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def decode_child(path: str, mime_type: str, variant: str):
+    """Decode one response in a fresh process and print the peak RSS increase (KiB)."""
+    from gemini_client import GeminiImageGenerator, decode_image
+    from image_utils import prepare_image_for_display
+
+    with open(path, 'rb') as f:
+        response = make_response(f.read(), mime_type)
+    baseline = reset_peak_rss()
+    start = timeit.default_timer()
+    if variant == 'legacy':
+        image = extract_image_legacy(response)
+    else:
+        data, _ = GeminiImageGenerator._take_image_data(response)
+        del response
+        image = decode_image(data, EPD_WIDTH, EPD_HEIGHT)
+        del data
+    prepare_image_for_display(image, EPD_WIDTH, EPD_HEIGHT)
+    elapsed = timeit.default_timer() - start
+    print(peak_rss() - baseline, elapsed, *image.size)
+
+
+def bench_decode(repeat: int, sizes=((1024, 1024), (2048, 2048))):
+    """Peak RSS and time of decoding a response image and resizing it for the panel."""
+    import tempfile
+    print("decode response + resize (peak RSS increase, fresh process per run)")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            source = make_gradient_image(*size)
+            for fmt, mime_type in (("PNG", "image/png"), ("JPEG", "image/jpeg")):
+                path = os.path.join(directory, f"response.{fmt.lower()}")
+                source.save(path, fmt)
+                for variant in ("legacy", "streamed"):
+                    runs = []
+                    for _ in range(repeat):
+                        out = subprocess.run(
+                            [sys.executable, __file__, '--decode-child', path, mime_type, variant],
+                            check=True, capture_output=True, text=True).stdout.split()
+                        runs.append((int(out[0]), float(out[1]), out[2] + "x" + out[3]))
+                    peak_kib = min(run[0] for run in runs)
+                    report(f"{size[0]}x{size[1]} {fmt.lower()} {variant}", [run[1] for run in runs], 1,
+                           f"peak +{peak_kib / 1024:5.1f} MiB, decoded {runs[0][2]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help="Timing repetitions (best is reported)")
+    parser.add_argument('--decode-child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.decode_child:
+        decode_child(*args.decode_child)
+        return
+
+    bench_pack(args.repeat)
+    bench_lut(args.repeat)
+    bench_dither(args.repeat)
+    bench_display(args.repeat)
+    bench_decode(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,357 @@ Core image generation and display logic.
 Shared by both CLI (main.py) and web app (app.py).
 """
 
+import os
+import json
+import asyncio
 import logging
-from typing import Dict, Any, Callable, Optional
+import time
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from PIL import Image
+import dithering
+from archive_writer import get_archive_writer
+from display_session import DisplaySession, get_session
 from epd_color import EPD
-from gemini_client import GeminiImageGenerator
-from image_utils import save_image_with_timestamp, prepare_image_for_display, log_prompt_to_csv
+from frame_cache import FrameCache, frame_key, DEFAULT_MAX_ENTRIES
+from gemini_client import get_generator
+from image_utils import prepare_image_for_display, find_latest_image, pack_pixels
+from pipeline_stats import StageTimer, record_run
+from prefetch import PrefetchQueue, get_queue
+from prompt_history import get_prompt_history
+from prompt_cache import PromptCache, get_prompt_cache, DEFAULT_MAX_ENTRIES as PROMPT_CACHE_MAX_ENTRIES
+from resilience import ServiceUnavailableError
 
 logger = logging.getLogger(__name__)
 
+# Runs panel initialization concurrently with image generation
+_panel_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='panel-wake')
+
+# Concurrent Gemini calls of a batch run
+BATCH_CONCURRENCY = 3
+
+
+def _status_updater(status_callback: Optional[Callable[[str], None]]) -> Callable[[str], None]:
+    def update_status(msg: str):
+        """Helper to update status via callback and logger."""
+        logger.info(msg)
+        if status_callback:
+            status_callback(msg)
+    return update_status
+
+
+def _frame_params(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Conversion parameters that determine the packed buffer of an image."""
+    return {
+        'width': config.get('width', 800),
+        'height': config.get('height', 480),
+        'dither': config.get('dither', 'pil'),
+        'dither_strength': config.get('dither_strength', 1.0),
+        'dither_serpentine': config.get('dither_serpentine', False),
+    }
+
+
+def build_panel_buffer(
+    image: Image.Image,
+    config: Dict[str, Any],
+    epd: EPD,
+    update_status: Callable[[str], None],
+    timer: Optional[StageTimer] = None
+) -> bytes:
+    """
+    Resize, quantize and pack an image, reusing a cached buffer when possible.
+
+    Args:
+        image: Source PIL Image at any size
+        config: Configuration dict (see generate_and_display_image)
+        epd: EPD driver used for conversion (the panel is not touched)
+        update_status: Progress callback
+        timer: Records the prepare, quantize and pack stages
+
+    Returns:
+        Packed panel buffer
+    """
+    timer = timer or StageTimer()
+    params = _frame_params(config)
+
+    cache = None
+    with timer.stage('prepare') as stage:
+        cache_size = config.get('frame_cache_size', DEFAULT_MAX_ENTRIES)
+        if cache_size > 0:
+            cache_dir = config.get('frame_cache_dir') or os.path.join(
+                config.get('image_dir', 'generated_images'), 'frame_cache')
+            cache = FrameCache(cache_dir, max_entries=cache_size)
+            key = frame_key(image, params)
+            buffer = cache.get(key)
+            if buffer is not None:
+                update_status("Using cached EPD buffer...")
+                stage.update(frame_cache_hit=True, bytes=len(buffer))
+                return buffer
+
+        update_status("Preparing image for display...")
+        display_image = prepare_image_for_display(image, params['width'], params['height'])
+
+    update_status("Converting image to EPD buffer...")
+    with timer.stage('quantize') as stage:
+        codes = epd.quantize(display_image, params['dither'], params['dither_strength'],
+                             params['dither_serpentine'])
+        stage['bytes'] = len(codes)
+
+    with timer.stage('pack') as stage:
+        buffer = pack_pixels(codes)
+        stage['bytes'] = len(buffer)
+
+    if cache is not None:
+        try:
+            cache.put(key, buffer)
+        except OSError as e:
+            logger.warning(f"Could not store frame in cache: {e}")
+    return buffer
+
+
+def push_to_panel(
+    session: DisplaySession,
+    buffer: bytes,
+    config: Dict[str, Any],
+    update_status: Callable[[str], None],
+    timer: Optional[StageTimer] = None
+) -> bool:
+    """
+    Wake the panel and display buffer unless the panel already shows it.
+
+    Powers the module off if the refresh fails.
+
+    Args:
+        timer: Records the wake, transfer, refresh and (with no idle
+            timeout) sleep stages
+
+    Returns:
+        True if the panel was refreshed, False if the refresh was skipped
+    """
+    timer = timer or StageTimer()
+    force = config.get('force_refresh', False)
+    if not force and session.is_showing(buffer):
+        update_status("Frame unchanged, skipping panel refresh")
+        # The panel may have been woken early for this frame
+        session.schedule_sleep()
+        return False
+
+    try:
+        update_status("Initializing e-paper display...")
+        if session.state == session.AWAKE:
+            session.wake()
+        else:
+            with timer.stage('wake'):
+                session.wake()
+
+        update_status("Displaying image on EPD (this may take 15-30 seconds)...")
+        # The session puts the panel to sleep after its idle timeout
+        try:
+            return session.display(buffer, force=force)
+        finally:
+            timings = session.last_timings
+            timer.add('transfer', timings.get('transfer'), bytes=len(buffer))
+            timer.add('refresh', timings.get('refresh'))
+            timer.add('sleep', timings.get('sleep'))
+    except Exception:
+        # Always try to cleanup EPD
+        try:
+            session.close()
+        except Exception as cleanup_error:
+            logger.error(f"EPD cleanup failed: {cleanup_error}")
+        raise
+
+
+def _wake_early(session: DisplaySession, config: Dict[str, Any]) -> Optional['Future[float]']:
+    """
+    Start initializing the panel on a worker thread so it is ready when the
+    image is. Called only once a Gemini request is about to be sent, so a
+    prompt cache hit or an open circuit never wakes the panel early.
+    Disabled with early_wake=False.
+
+    Returns:
+        Future resolving to the seconds the wake took, or None
+    """
+    if not config.get('early_wake', True):
+        return None
+
+    def wake() -> float:
+        start = time.monotonic()
+        session.wake()
+        return time.monotonic() - start
+
+    return _panel_executor.submit(wake)
+
+
+def _join_early_wake(early_wake: Optional['Future[float]'], timer: StageTimer) -> None:
+    """Wait for an early wake and record it as the (overlapped) wake stage."""
+    if early_wake is None:
+        return
+    try:
+        timer.add('wake', early_wake.result(), overlapped=True)
+    except Exception as e:
+        # push_to_panel retries the wake and reports the error
+        logger.warning(f"Early panel wake failed: {type(e).__name__}: {e}")
+
+
+def _release_early_wake(session: DisplaySession, early_wake: Optional['Future[float]']) -> None:
+    """
+    Undo an early wake after the pipeline failed before displaying anything.
+
+    Runs once the wake has finished: deep sleeps the panel, or powers the
+    module off if the wake itself failed.
+    """
+    if early_wake is None:
+        return
+
+    def release(future: 'Future[float]'):
+        try:
+            if future.exception() is not None:
+                session.close()
+            else:
+                session.sleep()
+        except Exception as e:
+            logger.error(f"EPD cleanup failed: {e}")
+
+    early_wake.add_done_callback(release)
+
+
+def _prompt_cache(config: Dict[str, Any]) -> Optional[PromptCache]:
+    """Return the shared prompt cache, or None if it is disabled."""
+    ttl = config.get('prompt_cache_ttl', 0)
+    if ttl <= 0:
+        return None
+    directory = config.get('prompt_cache_dir') or os.path.join(
+        config.get('image_dir', 'generated_images'), 'originals')
+    return get_prompt_cache(directory, ttl=ttl,
+                            max_entries=config.get('prompt_cache_size', PROMPT_CACHE_MAX_ENTRIES))
+
+
+def _decoded_size(image: Image.Image) -> int:
+    """Bytes of decoded pixel data held by image."""
+    return image.width * image.height * len(image.getbands())
+
+
+def _check_generation_request(prompt: str, config: Dict[str, Any]) -> str:
+    """Validate prompt and API key, returning the key."""
+    api_key = config.get('api_key')
+    if not api_key or api_key == 'your_api_key_here':
+        raise ValueError("GEMINI_API_KEY not configured in .env file")
+
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt cannot be empty")
+    return api_key
+
+
+def _start_archive(raw_image: Image.Image, config: Dict[str, Any],
+                   update_status: Callable[[str], None]) -> 'Future[str]':
+    """Queue the original for saving on the archive writer thread."""
+    update_status("Saving original image in the background...")
+    return get_archive_writer().submit(
+        raw_image,
+        directory=config.get('image_dir', 'generated_images'),
+        image_format=config.get('archive_format', 'png'),
+        compress_level=config.get('archive_compress_level', 6)
+    )
+
+
+def _finish_archive(pending: 'Future[str]', timer: StageTimer) -> str:
+    """Wait for a queued save; the save stage is the time left to wait."""
+    with timer.stage('save') as stage:
+        saved_path = pending.result()
+        stage['bytes'] = os.path.getsize(saved_path)
+    logger.info(f"Image saved to: {saved_path}")
+    return saved_path
+
+
+def _prepare_generated_image(
+    raw_image: Image.Image,
+    config: Dict[str, Any],
+    epd: EPD,
+    update_status: Callable[[str], None],
+    timer: StageTimer
+) -> Tuple[str, bytes]:
+    """Save and convert a freshly generated image, returning (path, buffer)."""
+    pending = _start_archive(raw_image, config, update_status)
+    buffer = build_panel_buffer(raw_image, config, epd, update_status, timer)
+    return _finish_archive(pending, timer), buffer
+
+
+def _display_generated_image(
+    raw_image: Image.Image,
+    config: Dict[str, Any],
+    update_status: Callable[[str], None],
+    timer: StageTimer,
+    early_wake: Optional['Future[float]'] = None
+) -> Dict[str, Any]:
+    """Save, convert and display a freshly generated image (blocking)."""
+    session = get_session()
+    # The original is written while the panel buffer is built and pushed
+    pending = _start_archive(raw_image, config, update_status)
+    try:
+        buffer = build_panel_buffer(raw_image, config, session.get_epd(), update_status, timer)
+    except Exception:
+        _release_early_wake(session, early_wake)
+        raise
+    _join_early_wake(early_wake, timer)
+    refreshed = push_to_panel(session, buffer, config, update_status, timer)
+    saved_path = _finish_archive(pending, timer)
+
+    return {
+        'success': True,
+        'message': 'Image generated and displayed successfully!' if refreshed
+                   else 'Image generated; display already showed it',
+        'image_path': saved_path,
+        'refresh_skipped': not refreshed
+    }
+
+
+def _failure_result(e: Exception, what: str = "Generation") -> Dict[str, Any]:
+    error_msg = f"{type(e).__name__}: {str(e)}"
+    logger.error(f"{what} failed: {error_msg}", exc_info=True)
+    return {
+        'success': False,
+        'error': str(e),
+        'message': f'Failed: {error_msg}'
+    }
+
+
+def _finish(result: Dict[str, Any], timer: StageTimer) -> Dict[str, Any]:
+    """Attach stage timings to a result and add them to the rolling histogram."""
+    result['stages'] = timer.stages
+    result['total_ms'] = timer.total_ms()
+    record_run(timer)
+    if timer.stages:
+        logger.info(f"Pipeline stages: {timer.summary()} (total {result['total_ms']:.0f} ms)")
+    return result
+
+
+def _fallback_display(
+    error: ServiceUnavailableError,
+    config: Dict[str, Any],
+    update_status: Callable[[str], None],
+    timer: StageTimer
+) -> Dict[str, Any]:
+    """Re-display the latest saved image after Gemini failed or the circuit is open."""
+    logger.warning(f"Gemini unavailable, falling back to the last image: {error}")
+    image_path = find_latest_image(config.get('image_dir', 'generated_images'))
+    if image_path is None:
+        return _failure_result(error)
+
+    try:
+        result = _show_saved_image(image_path, config, update_status, timer)
+    except Exception as e:
+        logger.error(f"Fallback display failed: {type(e).__name__}: {e}")
+        return _failure_result(error)
+    result.update(
+        fallback=True,
+        error=str(error),
+        message='Gemini unavailable, display keeps the last image' if result['refresh_skipped']
+                else 'Gemini unavailable, re-displayed the last image'
+    )
+    return result
+
 
 def generate_and_display_image(
     prompt: str,
@@ -28,6 +371,21 @@ def generate_and_display_image(
             - width: Target width (default: 800)
             - height: Target height (default: 480)
             - image_dir: Directory for saved images (default: generated_images)
+            - archive_format: Saved original format, 'png' or 'webp' (lossless, default: png)
+            - archive_compress_level: PNG zlib level 0-9 (default: 6)
+            - early_wake: Initialize the panel while the image is generated (default: True)
+            - dither: 'pil' or a dithering.METHODS name (default: pil)
+            - dither_strength: Dither strength 0-1 (default: 1.0)
+            - dither_serpentine: Serpentine error diffusion (default: False)
+            - frame_cache_dir: Packed buffer cache (default: <image_dir>/frame_cache)
+            - frame_cache_size: Cached buffers kept, 0 disables (default: 200)
+            - force_refresh: Refresh even if the frame is already shown (default: False)
+            - prompt_cache_ttl: Seconds a prompt's image is reused, 0 disables (default: 0)
+            - prompt_cache_size: Cached prompt results kept (default: 50)
+            - prompt_cache_dir: Content-addressed originals (default: <image_dir>/originals)
+            - force_fresh: Call Gemini even on a prompt cache hit (default: False)
+            - prefetch_count: Frames generated ahead of time, 0 disables (default: 0)
+            - prefetch_dir: Prefetched frame queue (default: <image_dir>/prefetch)
         status_callback: Optional function(message) for progress updates
 
     Returns:
@@ -35,80 +393,402 @@ def generate_and_display_image(
             - success: bool
             - message: str
             - image_path: str (if successful)
+            - refresh_skipped: bool, panel already showed the frame (if successful)
+            - fallback: True if Gemini was unavailable and the last saved
+              image was shown instead (error holds the reason)
             - error: str (if failed)
+            - stages: {stage: {'ms': float, 'bytes': int, ...}} for the stages
+              that ran (see pipeline_stats.STAGES)
+            - total_ms: float, wall time of the whole run
     """
-    epd = None
+    update_status = _status_updater(status_callback)
+    timer = StageTimer()
+    session = get_session()
+    early_wake = None
 
-    def update_status(msg: str):
-        """Helper to update status via callback and logger."""
-        logger.info(msg)
-        if status_callback:
-            status_callback(msg)
+    try:
+        with timer.stage('validate'):
+            api_key = _check_generation_request(prompt, config)
+            model = config.get('model', 'gemini-2.5-flash-image')
+
+            # Log prompt to history
+            get_prompt_history().add(prompt)
+
+        def wake_on_request():
+            nonlocal early_wake
+            early_wake = _wake_early(session, config)
+
+        with timer.stage('generate') as stage:
+            update_status("Initializing Gemini client...")
+            generator = get_generator(api_key=api_key, model=model)
+
+            update_status("Generating image (this may take 5-15 seconds)...")
+            raw_image = generator.generate_image(
+                prompt, width=config.get('width', 800), height=config.get('height', 480),
+                cache=_prompt_cache(config), fresh=config.get('force_fresh', False),
+                on_request=wake_on_request)
+            stage['bytes'] = _decoded_size(raw_image)
+
+    except ServiceUnavailableError as e:
+        # The fallback reuses an early-woken panel
+        result = _fallback_display(e, config, update_status, timer)
+        if not result['success']:
+            _release_early_wake(session, early_wake)
+        return _finish(result, timer)
+
+    except BaseException as e:
+        _release_early_wake(session, early_wake)
+        if not isinstance(e, Exception):
+            raise
+        return _finish(_failure_result(e), timer)
 
     try:
-        # Validate configuration
-        api_key = config.get('api_key')
-        if not api_key or api_key == 'your_api_key_here':
-            raise ValueError("GEMINI_API_KEY not configured in .env file")
+        result = _display_generated_image(raw_image, config, update_status, timer, early_wake)
+    except Exception as e:
+        result = _failure_result(e)
+    return _finish(result, timer)
 
-        if not prompt or not prompt.strip():
-            raise ValueError("Prompt cannot be empty")
 
-        # Get configuration with defaults
-        model = config.get('model', 'gemini-2.5-flash-image')
-        width = config.get('width', 800)
-        height = config.get('height', 480)
-        image_dir = config.get('image_dir', 'generated_images')
+async def generate_and_display_image_async(
+    prompt: str,
+    config: Dict[str, Any],
+    status_callback: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Async variant of generate_and_display_image for use on an event loop.
 
-        # Log prompt to history
-        log_prompt_to_csv(prompt)
+    The Gemini request runs on the genai async API while the panel is
+    initialized on a worker thread. Saving, conversion and the panel
+    refresh block, so they run in a worker thread. Cancelling the
+    task aborts the request; once the panel stage has started it runs to
+    completion in its thread and only the await is abandoned.
 
-        update_status("Initializing Gemini client...")
-        generator = GeminiImageGenerator(api_key=api_key, model=model)
+    Args and Returns: as generate_and_display_image. status_callback is
+    called from the event loop and from the worker thread.
+    """
+    update_status = _status_updater(status_callback)
+    timer = StageTimer()
+    session = get_session()
+    early_wake = None
 
-        update_status(f"Generating image (this may take 5-15 seconds)...")
-        raw_image = generator.generate_image(prompt, width=width, height=height)
+    try:
+        with timer.stage('validate'):
+            api_key = _check_generation_request(prompt, config)
+            model = config.get('model', 'gemini-2.5-flash-image')
 
-        update_status("Saving original image...")
-        saved_path = save_image_with_timestamp(raw_image, directory=image_dir)
-        logger.info(f"Image saved to: {saved_path}")
+            await asyncio.to_thread(get_prompt_history().add, prompt)
 
-        update_status("Preparing image for display...")
-        display_image = prepare_image_for_display(raw_image, width, height)
+        def wake_on_request():
+            nonlocal early_wake
+            early_wake = _wake_early(session, config)
 
-        update_status("Initializing e-paper display...")
-        epd = EPD()
-        if epd.init() != 0:
-            raise RuntimeError("EPD initialization failed - check hardware connections")
+        with timer.stage('generate') as stage:
+            update_status("Initializing Gemini client...")
+            generator = await asyncio.to_thread(get_generator, api_key=api_key, model=model)
 
-        update_status("Converting image to EPD buffer...")
-        buffer = epd.getbuffer(display_image)
+            update_status("Generating image (this may take 5-15 seconds)...")
+            raw_image = await generator.generate_image_async(
+                prompt, width=config.get('width', 800), height=config.get('height', 480),
+                cache=_prompt_cache(config), fresh=config.get('force_fresh', False),
+                on_request=wake_on_request)
+            stage['bytes'] = _decoded_size(raw_image)
 
-        update_status("Displaying image on EPD (this may take 15-30 seconds)...")
-        epd.display(buffer)
+    except ServiceUnavailableError as e:
+        # The fallback reuses an early-woken panel
+        result = await asyncio.to_thread(_fallback_display, e, config, update_status, timer)
+        if not result['success']:
+            _release_early_wake(session, early_wake)
+        return _finish(result, timer)
 
-        update_status("Putting display to sleep...")
-        epd.sleep()
+    except BaseException as e:
+        # Also on cancellation: the cleanup runs once the wake has finished
+        _release_early_wake(session, early_wake)
+        if not isinstance(e, Exception):
+            raise
+        return _finish(_failure_result(e), timer)
+
+    try:
+        result = await asyncio.to_thread(_display_generated_image, raw_image, config, update_status,
+                                         timer, early_wake)
+    except Exception as e:
+        result = _failure_result(e)
+    return _finish(result, timer)
 
-        return {
-            'success': True,
-            'message': 'Image generated and displayed successfully!',
-            'image_path': saved_path
-        }
 
+def display_saved_image(
+    image_path: str,
+    config: Dict[str, Any],
+    status_callback: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Display an existing image file on the EPD, e.g. to re-show the last
+    image after a power cycle. Uses the frame cache, so a previously shown
+    image goes to the panel without any conversion.
+
+    Args:
+        image_path: Path to the source image
+        config: Configuration dict (see generate_and_display_image)
+        status_callback: Optional function(message) for progress updates
+
+    Returns:
+        Dict with success, message, image_path, refresh_skipped, stages,
+        total_ms / error (as generate_and_display_image)
+    """
+    update_status = _status_updater(status_callback)
+    timer = StageTimer()
+
+    try:
+        result = _show_saved_image(image_path, config, update_status, timer)
     except Exception as e:
-        error_msg = f"{type(e).__name__}: {str(e)}"
-        logger.error(f"Generation failed: {error_msg}", exc_info=True)
+        result = _failure_result(e, "Display")
+    return _finish(result, timer)
 
-        # Always try to cleanup EPD
-        if epd is not None:
-            try:
-                epd.sleep()
-            except Exception as cleanup_error:
-                logger.error(f"EPD cleanup failed: {cleanup_error}")
-
-        return {
-            'success': False,
-            'error': str(e),
-            'message': f'Failed: {error_msg}'
+
+def _show_saved_image(
+    image_path: str,
+    config: Dict[str, Any],
+    update_status: Callable[[str], None],
+    timer: StageTimer
+) -> Dict[str, Any]:
+    session = get_session()
+
+    update_status("Loading image...")
+    with Image.open(image_path) as image:
+        with timer.stage('load') as stage:
+            image.load()
+            stage['bytes'] = os.path.getsize(image_path)
+        buffer = build_panel_buffer(image, config, session.get_epd(), update_status, timer)
+
+    refreshed = push_to_panel(session, buffer, config, update_status, timer)
+
+    return {
+        'success': True,
+        'message': 'Image displayed successfully!' if refreshed
+                   else 'Display already showed this image',
+        'image_path': os.path.abspath(image_path),
+        'refresh_skipped': not refreshed
+    }
+
+
+def get_prefetch_queue(config: Dict[str, Any]) -> Optional[PrefetchQueue]:
+    """Return the shared prefetch queue, or None if prefetching is disabled."""
+    count = config.get('prefetch_count', 0)
+    if count <= 0:
+        return None
+    directory = config.get('prefetch_dir') or os.path.join(
+        config.get('image_dir', 'generated_images'), 'prefetch')
+    return get_queue(directory, capacity=count)
+
+
+async def prefetch_frames_async(
+    prompt: str,
+    config: Dict[str, Any],
+    status_callback: Optional[Callable[[str], None]] = None
+) -> int:
+    """
+    Generate and fully prepare frames until the prefetch queue is full.
+
+    Frames are saved, resized, quantized and packed but not displayed. Each
+    is tagged with the prompt and conversion parameters so a frame made for
+    an older prompt or configuration is never shown.
+
+    Args:
+        prompt: Text prompt for image generation
+        config: Configuration dict (see generate_and_display_image)
+        status_callback: Optional function(message) for progress updates
+
+    Returns:
+        Number of frames added
+
+    Raises:
+        ValueError: If prompt or API key are missing
+        Exception: If generation or conversion fails (frames already
+            queued are kept)
+    """
+    queue = get_prefetch_queue(config)
+    if queue is None:
+        return 0
+
+    update_status = _status_updater(status_callback)
+    api_key = _check_generation_request(prompt, config)
+    model = config.get('model', 'gemini-2.5-flash-image')
+    generator = await asyncio.to_thread(get_generator, api_key=api_key, model=model)
+    epd = get_session().get_epd()
+    metadata = {'prompt': prompt, 'params': _frame_params(config)}
+
+    added = 0
+    while not queue.is_full():
+        update_status(f"Prefetching frame {len(queue) + 1}/{queue.capacity}...")
+        timer = StageTimer('prefetch')
+        with timer.stage('generate') as stage:
+            # Queued frames should differ, so never answer from the prompt cache
+            raw_image = await generator.generate_image_async(
+                prompt, width=config.get('width', 800), height=config.get('height', 480),
+                cache=_prompt_cache(config), fresh=True)
+            stage['bytes'] = _decoded_size(raw_image)
+        saved_path, buffer = await asyncio.to_thread(
+            _prepare_generated_image, raw_image, config, epd, update_status, timer)
+        record_run(timer)
+        if not queue.push(buffer, dict(metadata, image_path=saved_path)):
+            break
+        added += 1
+    return added
+
+
+def display_prefetched_frame(
+    prompt: str,
+    config: Dict[str, Any],
+    status_callback: Optional[Callable[[str], None]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Display the oldest prefetched frame for prompt; only the panel transfer runs.
+
+    Args:
+        prompt: Current prompt; queued frames for other prompts are discarded
+        config: Configuration dict (see generate_and_display_image)
+        status_callback: Optional function(message) for progress updates
+
+    Returns:
+        Result dict as generate_and_display_image, or None if no matching
+        frame is queued (the caller should generate one live)
+    """
+    queue = get_prefetch_queue(config)
+    if queue is None:
+        return None
+
+    update_status = _status_updater(status_callback)
+    timer = StageTimer()
+    entry = queue.pop({'prompt': prompt, 'params': _frame_params(config)})
+    if entry is None:
+        logger.info("No prefetched frame available")
+        return None
+    buffer, metadata = entry
+
+    try:
+        get_prompt_history().add(prompt)
+        update_status("Using prefetched frame...")
+        refreshed = push_to_panel(get_session(), buffer, config, update_status, timer)
+        result = {
+            'success': True,
+            'message': 'Prefetched image displayed successfully!' if refreshed
+                       else 'Display already showed the prefetched image',
+            'image_path': metadata.get('image_path'),
+            'refresh_skipped': not refreshed
         }
+    except Exception as e:
+        result = _failure_result(e, "Display")
+    return _finish(result, timer)
+
+
+def convert_frame_files(image: Image.Image, params: Dict[str, Any], base_path: str) -> Dict[str, Any]:
+    """
+    Save an original and write its packed panel buffer and preview.
+
+    Runs in a worker process of generate_batch_async, so it only uses the
+    conversion code and never touches the panel.
+
+    Args:
+        image: Generated PIL Image
+        params: Conversion parameters from _frame_params
+        base_path: Output path without extension; writes base_path + '.png',
+            '.epd' and '.preview.png'
+
+    Returns:
+        File names written and the conversion time in milliseconds
+    """
+    start = time.monotonic()
+    image.save(base_path + '.png', 'PNG')
+    display_image = prepare_image_for_display(image, params['width'], params['height'])
+    codes = dithering.quantize(display_image, params['dither'],
+                               params['dither_strength'], params['dither_serpentine'])
+    with open(base_path + '.epd', 'wb') as f:
+        f.write(pack_pixels(codes))
+    dithering.render_codes(codes, params['width'], params['height']).save(base_path + '.preview.png')
+
+    name = os.path.basename(base_path)
+    return {
+        'original': name + '.png',
+        'buffer': name + '.epd',
+        'preview': name + '.preview.png',
+        'convert_ms': round((time.monotonic() - start) * 1000, 1),
+    }
+
+
+async def generate_batch_async(
+    prompts: List[str],
+    config: Dict[str, Any],
+    output_dir: str,
+    concurrency: int = BATCH_CONCURRENCY,
+    workers: Optional[int] = None,
+    status_callback: Optional[Callable[[str], None]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Generate and convert many frames offline, without touching the panel.
+
+    At most `concurrency` Gemini calls are in flight; resizing, quantizing
+    and packing run in a process pool so conversion of finished images
+    overlaps the remaining calls. Each frame is written as NNN.png
+    (original), NNN.epd (packed buffer, see push_to_panel) and
+    NNN.preview.png (the four-colour result), and manifest.json lists all
+    entries with the conversion parameters.
+
+    Args:
+        prompts: Text prompts, one frame each
+        config: Configuration dict (see generate_and_display_image)
+        output_dir: Directory for frames and manifest (created if missing)
+        concurrency: Maximum concurrent Gemini calls
+        workers: Conversion processes (default: CPU count)
+        status_callback: Optional function(message) for progress updates
+
+    Returns:
+        Manifest entries in prompt order; failed frames carry 'error'
+
+    Raises:
+        ValueError: If the API key is missing or no prompts are given
+    """
+    if not prompts:
+        raise ValueError("No prompts given")
+    update_status = _status_updater(status_callback)
+    api_key = _check_generation_request(prompts[0], config)
+    model = config.get('model', 'gemini-2.5-flash-image')
+    generator = await asyncio.to_thread(get_generator, api_key=api_key, model=model)
+    params = _frame_params(config)
+    cache = _prompt_cache(config)
+    os.makedirs(output_dir, exist_ok=True)
+    # Workers map the table the parent built instead of each building it
+    await asyncio.to_thread(dithering.warm_palette_lut, params['dither'], params['dither_strength'])
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max(1, concurrency))
+    done = 0
+
+    async def produce(index: int, prompt: str, pool: ProcessPoolExecutor) -> Dict[str, Any]:
+        nonlocal done
+        entry: Dict[str, Any] = {'index': index, 'prompt': prompt}
+        try:
+            if not prompt.strip():
+                raise ValueError("Prompt cannot be empty")
+            async with slots:
+                start = time.monotonic()
+                raw_image = await generator.generate_image_async(
+                    prompt, width=params['width'], height=params['height'],
+                    cache=cache, fresh=config.get('force_fresh', False))
+                entry['generate_ms'] = round((time.monotonic() - start) * 1000, 1)
+            entry.update(await loop.run_in_executor(
+                pool, convert_frame_files, raw_image, params, os.path.join(output_dir, f"{index:03d}")))
+        except Exception as e:
+            logger.error(f"Batch frame {index} failed: {e}")
+            entry['error'] = str(e)
+        done += 1
+        update_status(f"Batch: {done}/{len(prompts)} frames finished")
+        return entry
+
+    # Spawned workers do not inherit the event loop's or the HTTP client's threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        entries = await asyncio.gather(*(produce(index, prompt, pool)
+                                         for index, prompt in enumerate(prompts, start=1)))
+
+    manifest = {'model': model, 'params': params, 'frames': entries}
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return entries
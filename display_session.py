@@ -0,0 +1,245 @@
+"""
+Long-lived e-paper display session.
+
+Keeps one EPD instance per process and tracks whether the panel is awake,
+in deep sleep or powered off, so back-to-back refreshes skip the init,
+reset and power-down cycle. It also remembers a digest of the frame on the
+panel (persisted across restarts) and skips refreshes that would not change
+it. Shared by the CLI, web app and scheduler.
+"""
+
+import os
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+import epdconfig
+from epd_color import EPD
+from image_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a refresh before the panel is put into deep sleep
+DEFAULT_IDLE_TIMEOUT = 120.0
+
+# Kept next to the images, which is the directory the container mounts
+STATE_FILE_NAME = 'epd_state.json'
+
+
+def frame_digest(buffer) -> str:
+    """Hex SHA-256 of a packed panel buffer."""
+    return hashlib.sha256(bytes(buffer)).hexdigest()
+
+
+class DisplaySession:
+    """Thread-safe owner of the panel that only re-initializes when needed."""
+
+    OFF = 'off'          # Module not initialized, 5V off
+    AWAKE = 'awake'      # Initialized and ready to display
+    ASLEEP = 'asleep'    # Deep sleep, module still initialized
+
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT, state_file: Optional[str] = None):
+        """
+        Initialize display session.
+
+        Args:
+            idle_timeout: Seconds after the last refresh before deep sleep
+                (0 sleeps right after every refresh)
+            state_file: JSON file persisting the digest of the shown frame
+                (None keeps it in memory only)
+        """
+        self.idle_timeout = idle_timeout
+        self.state_file = state_file
+        self.epd: Optional[EPD] = None
+        self._state = self.OFF
+        self._lock = threading.RLock()
+        self._idle_timer: Optional[threading.Timer] = None
+        self._shown_digest: Optional[str] = self._load_shown_digest()
+        # Seconds spent in transfer, refresh and (if immediate) sleep by the last display()
+        self.last_timings: Dict[str, float] = {}
+
+    @property
+    def state(self) -> str:
+        """Current panel state: off, awake or asleep."""
+        with self._lock:
+            return self._state
+
+    def get_epd(self) -> EPD:
+        """Return the session's EPD driver without touching the panel."""
+        with self._lock:
+            if self.epd is None:
+                self.epd = EPD()
+            return self.epd
+
+    def wake(self) -> EPD:
+        """
+        Make sure the panel is initialized and cancel any pending idle sleep.
+
+        Returns:
+            The ready EPD driver
+
+        Raises:
+            RuntimeError: If EPD initialization fails
+        """
+        with self._lock:
+            self._cancel_idle_timer()
+            epd = self.get_epd()
+            if self._state == self.OFF:
+                logger.info("Initializing e-paper module")
+                if epdconfig.module_init() != 0:
+                    raise RuntimeError("EPD initialization failed - check hardware connections")
+                # Module is up; close() must release it even if init_panel fails
+                self._state = self.ASLEEP
+            if self._state == self.ASLEEP:
+                logger.info("Resetting and programming e-paper controller")
+                epd.init_panel()
+            self._state = self.AWAKE
+            return epd
+
+    def is_showing(self, buffer) -> bool:
+        """Whether buffer is the frame currently on the panel."""
+        with self._lock:
+            return self._shown_digest is not None and self._shown_digest == frame_digest(buffer)
+
+    def display(self, buffer, force: bool = False) -> bool:
+        """
+        Push a packed panel buffer and schedule the idle sleep.
+
+        Args:
+            buffer: Packed panel buffer
+            force: Refresh even if the panel already shows this frame
+
+        Returns:
+            True if the panel was refreshed, False if the refresh was skipped
+        """
+        digest = frame_digest(buffer)
+        with self._lock:
+            self.last_timings = {}
+            if not force and digest == self._shown_digest:
+                logger.info("Frame unchanged, skipping panel refresh")
+                return False
+            epd = self.wake()
+            # Panel content is unknown until the refresh completes
+            self._set_shown_digest(None)
+            timings = {}
+            try:
+                epd.display(buffer)
+                self._set_shown_digest(digest)
+                timings.update(transfer=epd.transfer_time, refresh=epd.refresh_time)
+            finally:
+                start = time.monotonic()
+                if self._schedule_idle_sleep():
+                    timings['sleep'] = time.monotonic() - start
+                self.last_timings = timings
+            return True
+
+    def clear(self, color: int = 0x55) -> None:
+        """Fill the panel with one color and schedule the idle sleep."""
+        with self._lock:
+            epd = self.wake()
+            self._set_shown_digest(None)
+            try:
+                epd.Clear(color)
+                self._set_shown_digest(frame_digest(bytes([color]) * (epd.width * epd.height // 4)))
+            finally:
+                self._schedule_idle_sleep()
+
+    def schedule_sleep(self) -> None:
+        """Restart the idle countdown of an awake panel, e.g. after a wake without refresh."""
+        with self._lock:
+            self._cancel_idle_timer()
+            if self._state == self.AWAKE:
+                self._schedule_idle_sleep()
+
+    def sleep(self) -> None:
+        """Put the panel into deep sleep now."""
+        with self._lock:
+            self._cancel_idle_timer()
+            if self._state == self.AWAKE:
+                logger.info("Putting e-paper panel into deep sleep")
+                self.epd.deep_sleep()
+                self._state = self.ASLEEP
+
+    def close(self) -> None:
+        """Deep sleep the panel and release the module (5V off)."""
+        with self._lock:
+            self._cancel_idle_timer()
+            if self._state == self.OFF:
+                return
+            logger.info("Powering off e-paper module")
+            try:
+                if self._state == self.AWAKE:
+                    self.epd.sleep()
+                else:
+                    self.epd.module_exit()
+            finally:
+                self._state = self.OFF
+
+    def _load_shown_digest(self) -> Optional[str]:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get('frame_digest')
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read display state {self.state_file}: {e}")
+            return None
+
+    def _set_shown_digest(self, digest: Optional[str]):
+        if digest == self._shown_digest:
+            return
+        self._shown_digest = digest
+        if not self.state_file:
+            return
+        try:
+            with atomic_write(self.state_file, 'w', encoding='utf-8') as f:
+                json.dump({'frame_digest': digest}, f)
+        except OSError as e:
+            logger.warning(f"Could not persist display state {self.state_file}: {e}")
+
+    def _schedule_idle_sleep(self) -> bool:
+        """Start the idle timer, or sleep right away (returns True) without a timeout."""
+        if self.idle_timeout <= 0:
+            self.sleep()
+            return True
+        self._idle_timer = threading.Timer(self.idle_timeout, self._on_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+        return False
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _on_idle(self):
+        try:
+            self.sleep()
+        except Exception as e:
+            logger.error(f"Idle deep sleep failed: {e}")
+
+
+_session: Optional[DisplaySession] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> DisplaySession:
+    """
+    Return the process-wide display session, creating it on first use.
+
+    The idle timeout is read from EPD_IDLE_TIMEOUT (seconds) and the frame
+    state file from EPD_STATE_FILE (default: epd_state.json in IMAGE_DIR).
+    The session powers the module off when the process exits.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            idle_timeout = float(os.getenv('EPD_IDLE_TIMEOUT', str(DEFAULT_IDLE_TIMEOUT)))
+            state_file = os.getenv('EPD_STATE_FILE') or os.path.join(
+                os.getenv('IMAGE_DIR', 'generated_images'), STATE_FILE_NAME)
+            _session = DisplaySession(idle_timeout=idle_timeout, state_file=state_file)
+            atexit.register(_session.close)
+        return _session
@@ -0,0 +1,334 @@
+"""
+Dithering engine for the 4-color (black/white/yellow/red) e-paper palette.
+
+Turns an RGB image into one panel code (0-3) per pixel. Ordered modes are
+fully vectorized; error diffusion runs over anti-diagonal wavefronts so each
+NumPy step handles every pixel whose neighbours are already final.
+"""
+
+import os
+import functools
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from PIL import Image
+from image_utils import atomic_write, pack_pixels
+
+logger = logging.getLogger(__name__)
+
+# Panel colors in 2-bit code order: black, white, yellow, red
+PALETTE = np.array([
+    (0, 0, 0),
+    (255, 255, 255),
+    (255, 255, 0),
+    (255, 0, 0),
+], dtype=np.float32)
+
+# Error diffusion kernels: ([(dy, dx, weight), ...], divisor)
+KERNELS = {
+    'floyd-steinberg': ([(0, 1, 7), (1, -1, 3), (1, 0, 5), (1, 1, 1)], 16),
+    'atkinson': ([(0, 1, 1), (0, 2, 1), (1, -1, 1), (1, 0, 1), (1, 1, 1), (2, 0, 1)], 8),
+    'stucki': ([(0, 1, 8), (0, 2, 4),
+                (1, -2, 2), (1, -1, 4), (1, 0, 8), (1, 1, 4), (1, 2, 2),
+                (2, -2, 1), (2, -1, 2), (2, 0, 4), (2, 1, 2), (2, 2, 1)], 42),
+}
+
+ORDERED_METHODS = ('bayer', 'blue-noise')
+METHODS = ('none',) + ORDERED_METHODS + tuple(KERNELS)
+
+# Threshold amplitude of ordered dithering at strength 1.0
+ORDERED_SPREAD = 128.0
+
+# Full 256^3 RGB -> code table, 2 bits per entry (4 MiB) after a palette header
+LUT_HEADER = PALETTE.astype(np.uint8).tobytes()
+LUT_SIZE = len(LUT_HEADER) + 256 ** 3 // 4
+
+
+def nearest_codes(pixels: np.ndarray) -> np.ndarray:
+    """
+    Map RGB values to the nearest palette code (squared Euclidean distance).
+
+    Args:
+        pixels: Array of shape (..., 3), any numeric dtype
+
+    Returns:
+        uint8 array of shape (...) with codes 0-3
+    """
+    diff = pixels[..., None, :].astype(np.float32) - PALETTE
+    return np.argmin(np.einsum('...ij,...ij->...i', diff, diff), axis=-1).astype(np.uint8)
+
+
+def build_palette_lut(path: str) -> None:
+    """
+    Compute the nearest-color code of every 24-bit RGB value and write the
+    packed table to path (atomically, one red plane at a time).
+    """
+    logger.info(f"Building palette lookup table: {path}")
+    gb = np.stack(np.meshgrid(np.arange(256), np.arange(256), indexing='ij'), axis=-1).reshape(-1, 2)
+    plane = np.empty((gb.shape[0], 3), dtype=np.float32)
+    plane[:, 1:] = gb
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with atomic_write(path) as f:
+        f.write(LUT_HEADER)
+        for r in range(256):
+            plane[:, 0] = r
+            f.write(pack_pixels(nearest_codes(plane).tobytes()))
+
+
+_lut: Optional[np.ndarray] = None
+_lut_lock = threading.Lock()
+
+
+def palette_lut() -> np.ndarray:
+    """
+    Memory-mapped palette lookup table, built on first use.
+
+    Location is PALETTE_LUT_FILE (default: palette_lut.bin in project root).
+    A file with the wrong size or palette header is rebuilt. Concurrent first
+    callers wait for a single build.
+    """
+    global _lut
+    if _lut is not None:
+        return _lut
+    with _lut_lock:
+        if _lut is None:
+            path = os.getenv('PALETTE_LUT_FILE', str(Path(__file__).parent / 'palette_lut.bin'))
+            valid = False
+            if os.path.exists(path) and os.path.getsize(path) == LUT_SIZE:
+                with open(path, 'rb') as f:
+                    valid = f.read(len(LUT_HEADER)) == LUT_HEADER
+            if not valid:
+                build_palette_lut(path)
+            _lut = np.memmap(path, dtype=np.uint8, mode='r', offset=len(LUT_HEADER))
+        return _lut
+
+
+def uses_palette_lut(method: str, strength: float = 1.0) -> bool:
+    """Whether quantize() with this method and strength reads the lookup table."""
+    return method != 'pil' and (method == 'none' or strength <= 0 or method in ORDERED_METHODS)
+
+
+def warm_palette_lut(method: str, strength: float = 1.0) -> None:
+    """
+    Build or map the lookup table up front if the method needs it.
+
+    Call once at startup so the first frame does not pay for the build and
+    worker processes (which inherit PALETTE_LUT_FILE) only map a ready file.
+    """
+    if uses_palette_lut(method, strength):
+        palette_lut()
+
+
+def lut_codes(rgb: np.ndarray) -> np.ndarray:
+    """
+    Nearest palette codes via the lookup table: one gather per pixel.
+
+    Args:
+        rgb: uint8 array of shape (..., 3); other dtypes are rounded and clipped
+
+    Returns:
+        uint8 array of shape (...) with codes 0-3
+    """
+    if rgb.dtype != np.uint8:
+        rgb = np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+    index = ((rgb[..., 0].astype(np.uint32) << 16)
+             | (rgb[..., 1].astype(np.uint32) << 8)
+             | rgb[..., 2])
+    shift = (6 - 2 * (index & 3)).astype(np.uint8)
+    return (palette_lut()[index >> 2] >> shift) & 3
+
+
+@functools.cache
+def bayer_matrix(size: int = 8) -> np.ndarray:
+    """Bayer threshold matrix (size must be a power of two), values in (0, 1)."""
+    matrix = np.zeros((1, 1), dtype=np.float32)
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2],
+                           [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size
+
+
+@functools.cache
+def blue_noise_matrix(size: int = 64, sigma: float = 1.5, seed: int = 0) -> np.ndarray:
+    """
+    Blue-noise threshold matrix built with the void-and-cluster method.
+
+    Deterministic for a given seed and computed once per process.
+
+    Returns:
+        float32 array of shape (size, size) with values in (0, 1)
+    """
+    n = size * size
+    d = np.minimum(np.arange(size), size - np.arange(size))
+    kernel = np.exp(-(d[:, None] ** 2 + d[None, :] ** 2) / (2 * sigma ** 2))
+
+    def splat(index):
+        return np.roll(kernel, divmod(int(index), size), axis=(0, 1)).ravel()
+
+    rng = np.random.default_rng(seed)
+    pattern = np.zeros(n, dtype=bool)
+    pattern[rng.choice(n, n // 10, replace=False)] = True
+    energy = np.fft.irfft2(np.fft.rfft2(pattern.reshape(size, size)) * np.fft.rfft2(kernel),
+                           s=(size, size)).ravel()
+
+    # Relax the initial pattern: move tightest cluster into largest void
+    while True:
+        cluster = np.argmax(np.where(pattern, energy, -np.inf))
+        pattern[cluster] = False
+        energy -= splat(cluster)
+        void = np.argmin(np.where(pattern, np.inf, energy))
+        pattern[void] = True
+        energy += splat(void)
+        if void == cluster:
+            break
+
+    ranks = np.zeros(n, dtype=np.int32)
+    ones = int(pattern.sum())
+
+    # Rank the initial points by repeatedly removing the tightest cluster
+    p, e = pattern.copy(), energy.copy()
+    for rank in range(ones - 1, -1, -1):
+        cluster = np.argmax(np.where(p, e, -np.inf))
+        p[cluster] = False
+        e -= splat(cluster)
+        ranks[cluster] = rank
+
+    # Fill the rest by repeatedly adding to the largest void
+    p, e = pattern, energy
+    for rank in range(ones, n):
+        void = np.argmin(np.where(p, np.inf, e))
+        p[void] = True
+        e += splat(void)
+        ranks[void] = rank
+
+    return ((ranks + 0.5) / n).reshape(size, size).astype(np.float32)
+
+
+def ordered_dither(rgb: np.ndarray, matrix: np.ndarray, strength: float = 1.0) -> np.ndarray:
+    """Offset each pixel by a tiled threshold matrix and pick the nearest color."""
+    height, width, _ = rgb.shape
+    reps = (-(-height // matrix.shape[0]), -(-width // matrix.shape[1]))
+    threshold = np.tile(matrix - 0.5, reps)[:height, :width]
+    return lut_codes(rgb + (threshold * ORDERED_SPREAD * strength)[..., None])
+
+
+def error_diffusion(rgb: np.ndarray, kernel: str = 'floyd-steinberg',
+                    strength: float = 1.0, serpentine: bool = False) -> np.ndarray:
+    """
+    Error-diffusion dithering.
+
+    All pixels on an anti-diagonal x + k*y == t are independent and are
+    quantized in one vectorized step. A true serpentine scan would chain
+    every pixel to the one before it, so serpentine mode instead mirrors
+    the taps that reach lower rows on every odd row; this alternates the
+    diffusion bias per row like a serpentine scan while the same-row taps
+    keep pointing right and rows stay on the wavefront.
+
+    Args:
+        rgb: float32 array of shape (height, width, 3)
+        kernel: Name in KERNELS
+        strength: Fraction of the quantization error to diffuse
+        serpentine: Mirror the kernel's lower-row taps on odd rows
+
+    Returns:
+        uint8 array of codes with shape (height, width)
+    """
+    taps, divisor = KERNELS[kernel]
+    scale = strength / divisor
+
+    # Weight of each (dy, dx) offset on even and odd source rows
+    weights = {}
+    for dy, dx, weight in taps:
+        mirrored = (dy, -dx if serpentine and dy > 0 else dx)
+        weights.setdefault((dy, dx), [0.0, 0.0])[0] += weight * scale
+        weights.setdefault(mirrored, [0.0, 0.0])[1] += weight * scale
+    offsets = [(dy, dx, np.array(pair, dtype=np.float32)) for (dy, dx), pair in weights.items()]
+
+    height, width, _ = rgb.shape
+    pad = max(abs(dx) for _, dx, _ in offsets)
+    drop = max(dy for dy, _, _ in offsets)
+    work = np.zeros((height + drop, width + 2 * pad, 3), dtype=np.float32)
+    work[:height, pad:pad + width] = rgb
+    codes = np.zeros((height, width), dtype=np.uint8)
+
+    # Smallest k so that every tap lands on a later wavefront
+    k = max([1] + [-dx // dy + 1 for dy, dx, _ in offsets if dy > 0])
+
+    rows = np.arange(height)
+    for t in range(width + k * (height - 1)):
+        ys = rows[max(0, -(-(t - width + 1) // k)):min(height - 1, t // k) + 1]
+        xs = t - k * ys
+        px = work[ys, xs + pad]
+        c = nearest_codes(px)
+        codes[ys, xs] = c
+        err = px - PALETTE[c]
+        parity = ys & 1
+        for dy, dx, pair in offsets:
+            work[ys + dy, xs + pad + dx] += err * pair[parity][:, None]
+    return codes
+
+
+def quantize(image: Image.Image, method: str = 'pil',
+             strength: float = 1.0, serpentine: bool = False) -> bytes:
+    """
+    Quantize an image to panel codes with PIL's palette quantizer or dither().
+
+    Args:
+        image: Input PIL Image at panel size
+        method: 'pil' or one of METHODS
+        strength, serpentine: See dither()
+
+    Returns:
+        One code (0-3) per pixel, row-major, ready for pack_pixels()
+    """
+    if method == 'pil':
+        # Create a pallette with the 4 colors supported by the panel
+        pal_image = Image.new("P", (1, 1))
+        pal_image.putpalette(PALETTE.astype(np.uint8).ravel().tolist() + [0, 0, 0] * 252)
+        return image.convert("RGB").quantize(palette=pal_image).tobytes('raw')
+    return dither(image, method, strength, serpentine)
+
+
+def render_codes(codes: bytes, width: int, height: int) -> Image.Image:
+    """Render panel codes as the RGB image the panel would show."""
+    image = Image.frombytes('P', (width, height), bytes(codes))
+    image.putpalette(PALETTE.astype(np.uint8).ravel().tolist())
+    return image.convert('RGB')
+
+
+def dither(image: Image.Image, method: str = 'floyd-steinberg',
+           strength: float = 1.0, serpentine: bool = False) -> bytes:
+    """
+    Quantize an image to panel codes.
+
+    Args:
+        image: Input PIL Image (converted to RGB)
+        method: One of METHODS ('none' maps to the nearest color via the lookup table)
+        strength: Dither strength, 0 disables, 1 is the classic amount
+        serpentine: Serpentine scanning for error-diffusion methods
+
+    Returns:
+        One code (0-3) per pixel, row-major, ready for pack_pixels()
+
+    Raises:
+        ValueError: If method is unknown
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown dither method '{method}', expected one of: {', '.join(METHODS)}")
+
+    logger.debug(f"Dithering {image.size[0]}x{image.size[1]} with {method} (strength {strength})")
+    if method == 'none' or strength <= 0:
+        return lut_codes(np.asarray(image.convert("RGB"))).tobytes()
+
+    rgb = np.asarray(image.convert("RGB"), dtype=np.float32)
+    if method == 'bayer':
+        codes = ordered_dither(rgb, bayer_matrix(), strength)
+    elif method == 'blue-noise':
+        codes = ordered_dither(rgb, blue_noise_matrix(), strength)
+    else:
+        codes = error_diffusion(rgb, method, strength, serpentine)
+    return codes.tobytes()
@@ -29,16 +29,18 @@
 #
 
 import logging
+import time
 import epdconfig
-
-import PIL
-from PIL import Image
-import io
+import dithering
+from image_utils import pack_pixels
 
 # Display resolution
 EPD_WIDTH       = 800
 EPD_HEIGHT      = 480
 
+# Longest expected BUSY phase; a full refresh takes 15-30 s
+BUSY_TIMEOUT    = 60
+
 logger = logging.getLogger(__name__)
 
 class EPD:
@@ -49,6 +51,9 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.busy_timeout = BUSY_TIMEOUT   # seconds, None waits forever
+        self.refresh_time = None           # seconds the last refresh kept BUSY low
+        self.transfer_time = None          # seconds to power on and send the last frame
         self.BLACK  = 0x000000   #   00  BGR
         self.WHITE  = 0xffffff   #   01
         self.YELLOW = 0x00ffff   #   10
@@ -74,23 +79,33 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    # Stream a whole data phase with a single DC/CS toggle
+    def send_data2(self, data):
+        chunk = epdconfig.spi_bufsiz()
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        for i in range(0, len(data), chunk):
+            epdconfig.spi_writebyte2(data[i:i + chunk])
+        epdconfig.digital_write(self.cs_pin, 1)
         
     def ReadBusyH(self):
         logger.debug("e-Paper busy H")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            epdconfig.delay_ms(5)
-        logger.debug("e-Paper busy H release")
+        elapsed = epdconfig.wait_for_level(self.busy_pin, 1, self.busy_timeout)   # 0: busy, 1: idle
+        logger.debug("e-Paper busy H release after %.0f ms" % (elapsed * 1000))
+        return elapsed
 
     def ReadBusyL(self):
         logger.debug("e-Paper busy L")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: busy, 1: idle
-            epdconfig.delay_ms(5)
-        logger.debug("e-Paper busy L release")
+        elapsed = epdconfig.wait_for_level(self.busy_pin, 0, self.busy_timeout)   # 0: idle, 1: busy
+        logger.debug("e-Paper busy L release after %.0f ms" % (elapsed * 1000))
+        return elapsed
 
     def TurnOnDisplay(self):
         self.send_command(0x12) # DISPLAY_REFRESH
         self.send_data(0x01)
-        self.ReadBusyH()
+        self.refresh_time = self.ReadBusyH()
+        logger.info("Panel refresh took %.1f s" % self.refresh_time)
 
         self.send_command(0x02) # POWER_OFF
         self.send_data(0X00)
@@ -99,6 +114,10 @@ class EPD:
     def init(self):
         if (epdconfig.module_init() != 0):
             return -1
+        return self.init_panel()
+
+    # Reset and program the controller; also wakes the panel from deep sleep
+    def init_panel(self):
         # EPD hardware init start
         self.reset()
         self.ReadBusyH()
@@ -170,11 +189,12 @@ class EPD:
         self.send_data(0x01)
         return 0
 
-    def getbuffer(self, image):
-        # Create a pallette with the 4 colors supported by the panel
-        pal_image = Image.new("P", (1,1))
-        pal_image.putpalette( (0,0,0,  255,255,255,  255,255,0,   255,0,0) + (0,0,0)*252)
+    # dither: 'pil' (PIL Floyd-Steinberg) or one of dithering.METHODS
+    def getbuffer(self, image, dither='pil', strength=1.0, serpentine=False):
+        # Pack 4 pixels into a single byte to transfer to the panel
+        return pack_pixels(self.quantize(image, dither, strength, serpentine))
 
+    def quantize(self, image, dither='pil', strength=1.0, serpentine=False):
         # Check if we need to rotate the image
         imwidth, imheight = image.size
         if(imwidth == self.width and imheight == self.height):
@@ -185,16 +205,8 @@ class EPD:
             logger.warning("Invalid image dimensions: %d x %d, expected %d x %d" % (imwidth, imheight, self.width, self.height))
 
         # Convert the soruce image to the 4 colors, dithering if needed
-        image_4color = image_temp.convert("RGB").quantize(palette=pal_image)
-        buf_4color = bytearray(image_4color.tobytes('raw'))
-
-        # into a single byte to transfer to the panel
-        buf = [0x00] * int(self.width * self.height / 4)
-        idx = 0
-        for i in range(0, len(buf_4color), 4):
-            buf[idx] = (buf_4color[i] << 6) + (buf_4color[i+1] << 4) + (buf_4color[i+2] << 2) + buf_4color[i+3]
-            idx += 1
-        return buf
+        # One color code (0-3) per pixel
+        return dithering.quantize(image_temp, dither, strength, serpentine)
 
     def display(self, image):
         if self.width % 4 == 0 :
@@ -203,13 +215,13 @@ class EPD:
             Width = self.width // 4 + 1
         Height = self.height
 
+        start = time.monotonic()
         self.send_command(0x04)
         self.ReadBusyH()
 
         self.send_command(0x10)
-        for j in range(0, Height):
-            for i in range(0, Width):
-                    self.send_data(image[i + j * Width])
+        self.send_data2(image[:Width * Height])
+        self.transfer_time = time.monotonic() - start
         self.TurnOnDisplay()
         
     def Clear(self, color=0x55):
@@ -223,19 +235,24 @@ class EPD:
         self.ReadBusyH()
 
         self.send_command(0x10)
-        for j in range(0, Height):
-            for i in range(0, Width):
-                self.send_data(color)
+        self.send_data2(bytes([color]) * (Width * Height))
 
         self.TurnOnDisplay()
 
-    def sleep(self):
+    # Enter deep sleep but keep the module powered; wake with init_panel()
+    def deep_sleep(self):
         self.send_command(0x02) # POWER_OFF
         self.send_data(0x00)
 
         self.send_command(0x07) # DEEP_SLEEP
         self.send_data(0XA5)
-        
+
+    def sleep(self):
+        self.deep_sleep()
+        self.module_exit()
+
+    # Let the controller settle in deep sleep, then release SPI/GPIO and cut 5V
+    def module_exit(self):
         epdconfig.delay_ms(2000)
         epdconfig.module_exit()
 ### END OF FILE ###
@@ -29,14 +29,32 @@
 
 import os
 import logging
-import sys
 import time
-import subprocess
+import functools
+import threading
+from collections import deque
 
 from ctypes import *
 
 logger = logging.getLogger(__name__)
 
+# Adaptive polling interval bounds for backends without edge detection
+BUSY_POLL_MIN_MS = 1
+BUSY_POLL_MAX_MS = 50
+
+SPIDEV_BUFSIZ_PATH = '/sys/module/spidev/parameters/bufsiz'
+SPIDEV_BUFSIZ_DEFAULT = 4096
+
+
+@functools.cache
+def spi_bufsiz():
+    """Largest single spidev transfer in bytes (kernel module parameter)."""
+    try:
+        with open(SPIDEV_BUFSIZ_PATH) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return SPIDEV_BUFSIZ_DEFAULT
+
 
 class RaspberryPi:
     # Pin definition
@@ -95,6 +113,12 @@ class RaspberryPi:
         elif pin == self.PWR_PIN:
             return self.PWR_PIN.value
 
+    def wait_busy(self, value, timeout=None):
+        # gpiozero sets these events from lgpio edge callbacks, no polling
+        if value:
+            return self.GPIO_BUSY_PIN.wait_for_press(timeout)
+        return self.GPIO_BUSY_PIN.wait_for_release(timeout)
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -301,22 +325,243 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
-if sys.version_info[0] == 2:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
-else:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
-output, _ = process.communicate()
-if sys.version_info[0] == 2:
-    output = output.decode(sys.stdout.encoding)
+class VirtualPanel:
+    """
+    Hardware-free stand-in for the panel, selected with EPD_BACKEND=virtual.
+
+    Records every command with its data bytes, models the BUSY pin with
+    per-command latencies and can render the last transferred frame to PNG.
 
-if "Raspberry" in output:
-    implementation = RaspberryPi()
-elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
-    implementation = SunriseX3()
-else:
-    implementation = JetsonNano()
+    Environment:
+        EPD_VIRTUAL_TIME_SCALE: Multiplier for all delays and busy times (default: 0, instant)
+        EPD_VIRTUAL_REFRESH_MS: Busy time of a display refresh (default: 20000)
+        EPD_VIRTUAL_OUTPUT: PNG path written on every refresh (default: none)
+    """
+    # Pin definition
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    WIDTH  = 800
+    HEIGHT = 480
+    # Panel palette in 2-bit code order: black, white, yellow, red
+    PALETTE = (0, 0, 0,  255, 255, 255,  255, 255, 0,  255, 0, 0)
+
+    # Commands kept in the log; payloads of 0x10 are released once refreshed
+    COMMAND_LOG_SIZE = 256
+
+    # BUSY latency in ms after reset and after each command
+    BUSY_MS = {
+        'reset': 20,
+        0x04: 100,     # POWER_ON
+        0x12: 20000,   # DISPLAY_REFRESH
+        0x02: 50,      # POWER_OFF
+    }
+
+    def __init__(self, time_scale=None, refresh_ms=None, output_path=None):
+        if time_scale is None:
+            time_scale = float(os.getenv('EPD_VIRTUAL_TIME_SCALE', '0'))
+        if refresh_ms is None:
+            refresh_ms = float(os.getenv('EPD_VIRTUAL_REFRESH_MS', self.BUSY_MS[0x12]))
+        if output_path is None:
+            output_path = os.getenv('EPD_VIRTUAL_OUTPUT')
+
+        self.time_scale = time_scale
+        self.busy_ms = dict(self.BUSY_MS)
+        self.busy_ms[0x12] = refresh_ms
+        self.output_path = output_path
+
+        self.pins = {self.RST_PIN: 0, self.DC_PIN: 0, self.CS_PIN: 1, self.PWR_PIN: 0}
+        # [(command, bytearray(data)), ...]
+        self.commands = deque(maxlen=self.COMMAND_LOG_SIZE)
+        self.frame = None        # Last data written after 0x10
+        self._frame_data = None  # Payload of the 0x10 currently being transferred
+        self.refresh_count = 0
+        self._busy_until = 0.0
+
+    def _set_busy(self, key):
+        ms = self.busy_ms.get(key, 0) * self.time_scale
+        self._busy_until = max(self._busy_until, time.monotonic() + ms / 1000.0)
+
+    def _receive(self, data):
+        if self.pins[self.DC_PIN] == 0:
+            for command in data:
+                payload = bytearray()
+                self.commands.append((command, payload))
+                if command == 0x10:
+                    self._release_frame_data()
+                    self._frame_data = payload
+                self._on_command(command)
+        elif self.commands:
+            self.commands[-1][1].extend(data)
+
+    def _on_command(self, command):
+        self._set_busy(command)
+        if command == 0x12:
+            # The frame was fully transferred by the time refresh is triggered
+            self.refresh_count += 1
+            if self._frame_data is not None:
+                self.frame = bytes(self._frame_data)
+                self._release_frame_data()
+                if self.output_path:
+                    self.save_png(self.output_path)
+
+    def _release_frame_data(self):
+        # Only self.frame keeps a transferred frame; its log entry keeps the command
+        if self._frame_data is not None:
+            self._frame_data.clear()
+            self._frame_data = None
+
+    def digital_write(self, pin, value):
+        if pin == self.RST_PIN and value and not self.pins[pin]:
+            self._set_busy('reset')
+        self.pins[pin] = 1 if value else 0
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 0 if time.monotonic() < self._busy_until else 1   # 0: busy, 1: idle
+        return self.pins.get(pin, 0)
+
+    def wait_busy(self, value, timeout=None):
+        if value:
+            remaining = self._busy_until - time.monotonic()
+            if timeout is not None and remaining > timeout:
+                time.sleep(timeout)
+                return False
+            if remaining > 0:
+                time.sleep(remaining)
+            return True
+        # Nothing but a command makes the virtual panel busy
+        return self.digital_read(self.BUSY_PIN) == 0
+
+    def delay_ms(self, delaytime):
+        if self.time_scale:
+            time.sleep(delaytime * self.time_scale / 1000.0)
+
+    def spi_writebyte(self, data):
+        self._receive(data)
+
+    def spi_writebyte2(self, data):
+        self._receive(data)
+
+    def render(self):
+        """Decode the last transferred frame into an RGB PIL Image."""
+        from PIL import Image
+
+        if self.frame is None:
+            raise RuntimeError('No frame has been transferred to the virtual panel')
+        codes = bytearray(len(self.frame) * 4)
+        for offset, shift in enumerate((6, 4, 2, 0)):
+            table = bytes((b >> shift) & 0x03 for b in range(256))
+            codes[offset::4] = self.frame.translate(table)
+        image = Image.frombytes('P', (self.WIDTH, self.HEIGHT), bytes(codes))
+        image.putpalette(self.PALETTE)
+        return image.convert('RGB')
+
+    def save_png(self, path):
+        self.render().save(path, 'PNG')
+        logger.debug("virtual panel frame written to %s" % path)
+
+    def module_init(self):
+        # Each power-up starts a fresh command log; the last frame is kept
+        self.commands.clear()
+        self._frame_data = None
+        self.pins[self.PWR_PIN] = 1
+        return 0
+
+    def module_exit(self):
+        logger.debug("virtual panel power off")
+        self.pins[self.RST_PIN] = 0
+        self.pins[self.DC_PIN] = 0
+        self.pins[self.PWR_PIN] = 0
+
+
+CPUINFO_PATH = '/proc/cpuinfo'
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+@functools.cache
+def is_raspberry_pi():
+    """Check /proc/cpuinfo for a Raspberry Pi (read once, cached)."""
+    try:
+        with open(CPUINFO_PATH, 'r', errors='replace') as f:
+            return 'Raspberry' in f.read()
+    except OSError:
+        return False
+
+
+def detect_backend_class():
+    """Pick the platform implementation class without instantiating it."""
+    if os.getenv('EPD_BACKEND', '').lower() == 'virtual':
+        return VirtualPanel
+    if is_raspberry_pi():
+        return RaspberryPi
+    if os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
+        return SunriseX3
+    return JetsonNano
+
+
+def get_backend():
+    """Return the platform implementation, detecting and creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = detect_backend_class()
+                logger.debug("Using EPD backend: %s" % backend_class.__name__)
+                _backend = backend_class()
+    return _backend
+
+
+def set_backend(backend):
+    """Install an explicit implementation (e.g. a configured VirtualPanel)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def wait_for_level(pin, value, timeout=None):
+    """
+    Block until pin reads value and return the elapsed time in seconds.
+
+    Uses the backend's edge-driven wait_busy() for the BUSY pin when it has
+    one, otherwise polls with an interval that backs off from
+    BUSY_POLL_MIN_MS to BUSY_POLL_MAX_MS.
+
+    Raises:
+        TimeoutError: If the level is not reached within timeout seconds
+    """
+    backend = get_backend()
+    start = time.monotonic()
+    if pin == backend.BUSY_PIN and hasattr(backend, 'wait_busy'):
+        reached = backend.wait_busy(value, timeout)
+    else:
+        interval = BUSY_POLL_MIN_MS
+        while backend.digital_read(pin) != value:
+            if timeout is not None and time.monotonic() - start >= timeout:
+                break
+            time.sleep(interval / 1000.0)
+            interval = min(interval * 2, BUSY_POLL_MAX_MS)
+        reached = backend.digital_read(pin) == value
+    if not reached:
+        raise TimeoutError("pin %d did not reach %d within %s s" % (pin, value, timeout))
+    return time.monotonic() - start
+
+
+def __getattr__(name):
+    # Module-level hardware API (digital_write, RST_PIN, ...) resolves to the
+    # backend lazily, so importing this module has no side effects
+    if name.startswith('_'):
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    if name == 'implementation':
+        return get_backend()
+    try:
+        return getattr(get_backend(), name)
+    except AttributeError:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name)) from None
 
 ### END OF FILE ###
@@ -0,0 +1,100 @@
+"""
+On-disk cache of packed EPD panel buffers.
+
+Entries are keyed by a content hash of the source image plus every
+parameter that affects the conversion (size, dithering), so re-displaying
+an image skips resizing, quantization and packing entirely.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+from PIL import Image
+from image_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Bump when the conversion pipeline changes in a way that alters buffers
+CACHE_VERSION = 1
+
+DEFAULT_MAX_ENTRIES = 200
+
+
+def frame_key(image: Image.Image, params: Dict[str, Any]) -> str:
+    """
+    Build the cache key for an image and its conversion parameters.
+
+    Args:
+        image: Source PIL Image (before resizing)
+        params: JSON-serializable conversion parameters
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    header = {'version': CACHE_VERSION, 'mode': image.mode, 'size': image.size, 'params': params}
+    digest.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class FrameCache:
+    """LRU-capped directory of packed buffers, one file per key."""
+
+    SUFFIX = '.epd'
+
+    def __init__(self, directory: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Initialize frame cache.
+
+        Args:
+            directory: Cache directory (created on first write)
+            max_entries: Entries kept before least recently used ones are evicted
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached buffer for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                buffer = f.read()
+            # mtime doubles as the LRU timestamp
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        logger.info(f"Frame cache hit: {key[:12]}")
+        return buffer
+
+    def put(self, key: str, buffer: bytes) -> None:
+        """Store a buffer atomically and evict old entries over the cap."""
+        os.makedirs(self.directory, exist_ok=True)
+        with atomic_write(self._path(key)) as f:
+            f.write(buffer)
+        logger.debug(f"Frame cache stored: {key[:12]}")
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(self.SUFFIX):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        continue
+            entries.sort()
+            for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+                try:
+                    os.unlink(path)
+                    logger.debug(f"Frame cache evicted: {os.path.basename(path)}")
+                except FileNotFoundError:
+                    pass
@@ -2,84 +2,421 @@
 Gemini API client for generating images.
 """
 import io
+import os
+import math
+import time
+import asyncio
 import logging
+import threading
+import contextvars
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import httpx
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from PIL import Image
+from prompt_cache import PromptCache, prompt_key
+from resilience import CircuitBreaker, RetryPolicy, ServiceUnavailableError
 
 logger = logging.getLogger(__name__)
 
+# Keep connections to the API open between generations
+HTTP_LIMITS = httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=300)
+
+# HTTP statuses worth retrying: timeouts, rate limiting and server errors
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Timing of the request in flight in the current thread or task
+_request_timing: contextvars.ContextVar[Optional[Dict[str, Optional[float]]]] = \
+    contextvars.ContextVar('gemini_request_timing', default=None)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed request may succeed when repeated."""
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS
+    return isinstance(error, (TimeoutError, httpx.TimeoutException, httpx.TransportError))
+
 
 class GeminiImageGenerator:
     """Client for generating images using Gemini API."""
 
-    def __init__(self, api_key: str, model: str = "gemini-2.5-flash-image"):
+    def __init__(self, api_key: str, model: str = "gemini-2.5-flash-image",
+                 retry_policy: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None):
         """
         Initialize Gemini image generator.
 
         Args:
             api_key: Gemini API key
             model: Model to use for image generation
+            retry_policy: Attempts, per-attempt deadline and backoff
+                (default: RetryPolicy())
+            circuit_breaker: Breaker shared by all calls of this generator
+                (default: CircuitBreaker())
         """
         if not api_key:
             raise ValueError("API key cannot be empty")
 
         self.api_key = api_key
         self.model = model
-        self.client = genai.Client(api_key=api_key)
-        logger.info(f"Initialized Gemini client with model: {model}")
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._stats_lock = threading.Lock()
+        self._total_request_ms = 0.0
+        self.stats: Dict[str, Any] = {
+            'model': model,
+            'startup_ms': None,
+            'requests': 0,
+            'retries': 0,
+            'timeouts': 0,
+            'failures': 0,
+            'last_error': None,
+            'last_first_byte_ms': None,
+            'last_request_ms': None,
+            'avg_request_ms': None,
+            'max_request_ms': None,
+        }
+        # Per-attempt deadline; the async path also enforces it with wait_for
+        self._request_config = types.GenerateContentConfig(
+            http_options=types.HttpOptions(timeout=int(self.retry_policy.timeout * 1000)))
+
+        start = time.monotonic()
+        self.client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(
+                client_args={
+                    'limits': HTTP_LIMITS,
+                    'event_hooks': {'response': [self._on_response_headers]},
+                },
+                async_client_args={
+                    'limits': HTTP_LIMITS,
+                    'event_hooks': {'response': [self._on_response_headers_async]},
+                },
+            ),
+        )
+        self.stats['startup_ms'] = (time.monotonic() - start) * 1000
+        logger.info(f"Initialized Gemini client with model: {model} "
+                    f"in {self.stats['startup_ms']:.0f} ms")
+
+    def _on_response_headers(self, response: httpx.Response):
+        # httpx calls response hooks once headers arrive, before the body is read
+        timing = _request_timing.get()
+        if timing is not None and timing['first_byte'] is None:
+            timing['first_byte'] = time.monotonic() - timing['start']
+
+    async def _on_response_headers_async(self, response: httpx.Response):
+        self._on_response_headers(response)
+
+    @staticmethod
+    def _build_prompt(prompt: str) -> str:
+        if not prompt:
+            raise ValueError("Prompt cannot be empty")
+        return f"{prompt} Make the main part of the image to be centered and only use about half the height of the image."
+
+    def _start_timing(self) -> contextvars.Token:
+        return _request_timing.set({'start': time.monotonic(), 'first_byte': None})
 
-    def generate_image(self, prompt: str, width: int = 800, height: int = 480) -> Image.Image:
+    def generate_image(self, prompt: str, width: int = 800, height: int = 480,
+                       cache: Optional[PromptCache] = None, fresh: bool = False,
+                       on_request: Optional[Callable[[], None]] = None) -> Image.Image:
         """
         Generate an image from a text prompt.
 
         Args:
             prompt: Text description of the image to generate
-            width: Desired image width (default: 800)
-            height: Desired image height (default: 480)
+            width: Display width; JPEG responses decode at the smallest
+                scale that covers width x height (default: 800)
+            height: Display height (default: 480)
+            cache: Prompt cache to answer from and store results in
+            fresh: Skip cache lookup and always call the API (the result is
+                still stored)
+            on_request: Called once the API will be called, i.e. after a
+                cache miss and once the circuit breaker allows the call
 
         Returns:
             PIL Image object
 
         Raises:
             ValueError: If prompt is empty or response doesn't contain image
-            Exception: For API errors
+            CircuitOpenError: If recent calls failed and the circuit is open
+            ServiceUnavailableError: If every attempt failed with a retryable error
+            Exception: For non-retryable API errors
         """
-        if not prompt:
-            raise ValueError("Prompt cannot be empty")
-
-        prompt = f"{prompt} Make the main part of the image to be centered and only use about half the height of the image."
+        prompt = self._build_prompt(prompt)
 
         logger.info(f"Generating image with prompt: {prompt}")
         logger.info(f"Target display resolution: {width}x{height}")
 
         try:
+            key = prompt_key(prompt, self.model)
+            if cache is not None and not fresh:
+                data = cache.get(key)
+                if data is not None:
+                    return decode_image(data, width, height)
+
             # Generate image (model will use its default aspect ratio and size)
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=[prompt],
-            )
+            response = self._call_with_retries(prompt, on_request)
+            data, mime_type = self._take_image_data(response)
+            # Drop the SDK response so only the encoded bytes outlive the call
+            del response
+            if cache is not None:
+                self._store_in_cache(cache, key, data, mime_type)
+            return decode_image(data, width, height)
+
+        except Exception as e:
+            logger.error(f"Failed to generate image: {e}")
+            raise
+
+    async def generate_image_async(self, prompt: str, width: int = 800, height: int = 480,
+                                   cache: Optional[PromptCache] = None, fresh: bool = False,
+                                   on_request: Optional[Callable[[], None]] = None) -> Image.Image:
+        """
+        Generate an image from a text prompt without blocking the event loop.
+
+        Uses the genai async API; cache access and decoding the response
+        image run in the default executor. Cancelling the awaiting task
+        aborts the request.
+
+        Args:
+            prompt: Text description of the image to generate
+            width: Display width; JPEG responses decode at the smallest
+                scale that covers width x height (default: 800)
+            height: Display height (default: 480)
+            cache: Prompt cache to answer from and store results in
+            fresh: Skip cache lookup and always call the API (the result is
+                still stored)
+            on_request: Called once the API will be called, i.e. after a
+                cache miss and once the circuit breaker allows the call
+
+        Returns:
+            PIL Image object
+
+        Raises:
+            ValueError: If prompt is empty or response doesn't contain image
+            CircuitOpenError: If recent calls failed and the circuit is open
+            ServiceUnavailableError: If every attempt failed with a retryable error
+            Exception: For non-retryable API errors
+        """
+        prompt = self._build_prompt(prompt)
+
+        logger.info(f"Generating image (async) with prompt: {prompt}")
+        logger.info(f"Target display resolution: {width}x{height}")
+
+        try:
+            loop = asyncio.get_running_loop()
+            key = prompt_key(prompt, self.model)
+            if cache is not None and not fresh:
+                data = await loop.run_in_executor(None, cache.get, key)
+                if data is not None:
+                    return await loop.run_in_executor(None, decode_image, data, width, height)
 
-            # Extract image from response
-            for part in response.parts:
-                if part.text is not None:
-                    logger.debug(f"Response text: {part.text}")
-                elif part.inline_data is not None:
-                    # Convert Gemini Image to PIL Image
-                    gemini_image = part.as_image()
-                    # Convert to PIL Image using _pil property or by converting to bytes
-                    if hasattr(gemini_image, '_pil'):
-                        pil_image = gemini_image._pil
-                    else:
-                        # Fallback: get the image data and convert
-                        image_bytes = part.inline_data.data
-                        pil_image = Image.open(io.BytesIO(image_bytes))
-
-                    logger.info(f"Image generated successfully: {pil_image.size[0]}x{pil_image.size[1]}")
-                    return pil_image
-
-            raise ValueError("No image data found in API response")
+            response = await self._call_with_retries_async(prompt, on_request)
+            data, mime_type = self._take_image_data(response)
+            del response
+            if cache is not None:
+                await loop.run_in_executor(None, self._store_in_cache, cache, key, data, mime_type)
+            return await loop.run_in_executor(None, decode_image, data, width, height)
 
         except Exception as e:
             logger.error(f"Failed to generate image: {e}")
             raise
+
+    def _call_with_retries(self, prompt: str, on_request: Optional[Callable[[], None]] = None):
+        """Run generate_content under the retry policy and circuit breaker."""
+        self.circuit_breaker.before_call()
+        if on_request is not None:
+            on_request()
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            token = self._start_timing()
+            try:
+                try:
+                    response = self.client.models.generate_content(
+                        model=self.model,
+                        contents=[prompt],
+                        config=self._request_config,
+                    )
+                finally:
+                    self._record_latency(token)
+            except Exception as e:
+                time.sleep(self._attempt_failed(e, attempt))
+                continue
+            self.circuit_breaker.record_success()
+            return response
+
+    async def _call_with_retries_async(self, prompt: str, on_request: Optional[Callable[[], None]] = None):
+        """Async variant of _call_with_retries."""
+        self.circuit_breaker.before_call()
+        if on_request is not None:
+            on_request()
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            token = self._start_timing()
+            try:
+                try:
+                    response = await asyncio.wait_for(
+                        self.client.aio.models.generate_content(
+                            model=self.model,
+                            contents=[prompt],
+                            config=self._request_config,
+                        ),
+                        timeout=self.retry_policy.timeout,
+                    )
+                finally:
+                    self._record_latency(token)
+            except Exception as e:
+                await asyncio.sleep(self._attempt_failed(e, attempt))
+                continue
+            self.circuit_breaker.record_success()
+            return response
+
+    def _attempt_failed(self, error: Exception, attempt: int) -> float:
+        """
+        Account for a failed attempt.
+
+        Returns:
+            Seconds to wait before the next attempt
+
+        Raises:
+            The error itself if it is not retryable, or ServiceUnavailableError
+            once the attempts are exhausted
+        """
+        retryable = is_retryable(error)
+        last_attempt = attempt >= self.retry_policy.max_attempts
+        with self._stats_lock:
+            if isinstance(error, (TimeoutError, httpx.TimeoutException)):
+                self.stats['timeouts'] += 1
+            self.stats['last_error'] = f"{type(error).__name__}: {error}"
+            if not retryable or last_attempt:
+                self.stats['failures'] += 1
+            else:
+                self.stats['retries'] += 1
+
+        if not retryable:
+            # The service answered; a bad request says nothing about its health
+            self.circuit_breaker.record_success()
+            raise error
+        if last_attempt:
+            self.circuit_breaker.record_failure()
+            raise ServiceUnavailableError(
+                f"Gemini unavailable after {attempt} attempt(s): {type(error).__name__}: {error}") from error
+
+        delay = self.retry_policy.delay(attempt)
+        logger.warning(f"Gemini attempt {attempt}/{self.retry_policy.max_attempts} failed "
+                       f"({type(error).__name__}: {error}), retrying in {delay:.1f} s")
+        return delay
+
+    @staticmethod
+    def _take_image_data(response) -> Tuple[bytes, Optional[str]]:
+        """Return the encoded bytes and MIME type of the first inline image of a generate_content response."""
+        for part in response.parts or ():
+            if part.text is not None:
+                logger.debug(f"Response text: {part.text}")
+            elif part.inline_data is not None and part.inline_data.data:
+                logger.debug(f"Response image: {part.inline_data.mime_type}, "
+                             f"{len(part.inline_data.data)} bytes")
+                return part.inline_data.data, part.inline_data.mime_type
+
+        raise ValueError("No image data found in API response")
+
+    @staticmethod
+    def _store_in_cache(cache: PromptCache, key: str, data: bytes, mime_type: Optional[str]):
+        try:
+            cache.put(key, data, mime_type)
+        except OSError as e:
+            logger.warning(f"Could not store image in prompt cache: {e}")
+
+    def _record_latency(self, token: contextvars.Token):
+        timing = _request_timing.get()
+        _request_timing.reset(token)
+        total = time.monotonic() - timing['start']
+        first_byte = timing['first_byte']
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats['last_request_ms'] = total * 1000
+            self._total_request_ms += total * 1000
+            self.stats['avg_request_ms'] = self._total_request_ms / self.stats['requests']
+            self.stats['max_request_ms'] = max(self.stats['max_request_ms'] or 0.0, total * 1000)
+            self.stats['last_first_byte_ms'] = first_byte * 1000 if first_byte is not None else None
+        if first_byte is not None:
+            logger.info(f"Gemini response: first byte after {first_byte:.2f} s, complete after {total:.2f} s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Snapshot of client startup, attempt and latency metrics and circuit state."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['circuit'] = self.circuit_breaker.snapshot()
+        return stats
+
+
+def decode_image(data: bytes, width: int, height: int) -> Image.Image:
+    """
+    Decode an encoded image once, at the smallest scale that still covers
+    width x height after an aspect-preserving resize.
+
+    JPEG data is scaled down by libjpeg while decoding (1/2, 1/4 or 1/8 via
+    draft()); other formats decode at full size. The returned image does not
+    keep a reference to data.
+
+    Args:
+        data: Encoded image bytes
+        width: Display width the image will be resized to
+        height: Display height the image will be resized to
+
+    Returns:
+        Loaded PIL Image
+    """
+    stream = io.BytesIO(data)
+    pil_image = Image.open(stream)
+    full_size = pil_image.size
+    scale = max(width / pil_image.width, height / pil_image.height)
+    if scale < 1:
+        pil_image.draft('RGB', (math.ceil(pil_image.width * scale), math.ceil(pil_image.height * scale)))
+    # Decode now (Image.open is lazy) so the work stays on this thread
+    pil_image.load()
+    stream.close()
+
+    if pil_image.size != full_size:
+        logger.info(f"Image generated successfully: {full_size[0]}x{full_size[1]}, "
+                    f"decoded at {pil_image.size[0]}x{pil_image.size[1]}")
+    else:
+        logger.info(f"Image generated successfully: {pil_image.size[0]}x{pil_image.size[1]}")
+    return pil_image
+
+
+_generators: Dict[Tuple[str, str], GeminiImageGenerator] = {}
+_generators_lock = threading.Lock()
+
+
+def get_generator(api_key: str, model: str = "gemini-2.5-flash-image") -> GeminiImageGenerator:
+    """
+    Return the process-wide generator for api_key and model, creating it on
+    first use so its HTTP connection pool and circuit breaker are shared
+    across generations.
+
+    Resilience settings are read from GEMINI_TIMEOUT (seconds per attempt,
+    default 60), GEMINI_MAX_ATTEMPTS (3), GEMINI_BACKOFF (seconds before the
+    first retry, 2), GEMINI_BREAKER_THRESHOLD (consecutive failed calls, 3)
+    and GEMINI_BREAKER_RESET (seconds open before a trial call, 300).
+    """
+    with _generators_lock:
+        generator = _generators.get((api_key, model))
+        if generator is None:
+            retry_policy = RetryPolicy(
+                max_attempts=int(os.getenv('GEMINI_MAX_ATTEMPTS', '3')),
+                timeout=float(os.getenv('GEMINI_TIMEOUT', '60')),
+                backoff=float(os.getenv('GEMINI_BACKOFF', '2')),
+            )
+            circuit_breaker = CircuitBreaker(
+                failure_threshold=int(os.getenv('GEMINI_BREAKER_THRESHOLD', '3')),
+                reset_timeout=float(os.getenv('GEMINI_BREAKER_RESET', '300')),
+            )
+            generator = GeminiImageGenerator(api_key=api_key, model=model, retry_policy=retry_policy,
+                                             circuit_breaker=circuit_breaker)
+            _generators[(api_key, model)] = generator
+        return generator
+
+
+def get_client_stats() -> List[Dict[str, Any]]:
+    """Metrics of every pooled generator."""
+    with _generators_lock:
+        generators = list(_generators.values())
+    return [generator.get_stats() for generator in generators]
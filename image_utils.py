@@ -3,14 +3,23 @@ Image processing utilities for EPD display.
 """
 
 import os
-import csv
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
-from pathlib import Path
+from typing import IO, Iterator, Optional
 from PIL import Image
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Lossless formats for archived originals
+ARCHIVE_FORMATS = ("png", "webp")
+
+# Process umask, read once: os.umask() can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 
 def prepare_image_for_display(
     image: Image.Image,
@@ -61,10 +70,30 @@ def prepare_image_for_display(
     return cropped
 
 
+def pack_pixels(pixels: bytes) -> bytes:
+    """
+    Pack 2-bit palette indices into the EPD panel buffer format.
+
+    Four consecutive pixels are packed into one byte, first pixel in the
+    most significant bits.
+
+    Args:
+        pixels: One palette index (0-3) per byte, e.g. from Image.tobytes('raw')
+
+    Returns:
+        Packed buffer with one byte per four pixels
+    """
+    codes = np.frombuffer(pixels, dtype=np.uint8).reshape(-1, 4)
+    packed = (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3]
+    return packed.tobytes()
+
+
 def save_image_with_timestamp(
     image: Image.Image,
     directory: str = "generated_images",
-    prefix: str = "landscape"
+    prefix: str = "landscape",
+    image_format: str = "png",
+    compress_level: int = 6
 ) -> str:
     """
     Save image with timestamp filename.
@@ -73,80 +102,79 @@ def save_image_with_timestamp(
         image: PIL Image to save
         directory: Directory to save to (default: "generated_images")
         prefix: Filename prefix (default: "landscape")
+        image_format: "png" or "webp", always lossless (default: "png")
+        compress_level: PNG zlib level 0-9, lower is faster (default: 6)
 
     Returns:
         Absolute path to saved file
+
+    Raises:
+        ValueError: If image_format is not supported
     """
+    if image_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unsupported archive format '{image_format}', "
+                         f"expected one of: {', '.join(ARCHIVE_FORMATS)}")
+
     # Create directory if it doesn't exist
     os.makedirs(directory, exist_ok=True)
 
     # Generate timestamp filename
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{prefix}_{timestamp}.png"
+    filename = f"{prefix}_{timestamp}.{image_format}"
     filepath = os.path.join(directory, filename)
 
-    # Save as PNG
-    image.save(filepath, "PNG")
+    if image_format == "webp":
+        image.save(filepath, "WEBP", lossless=True)
+    else:
+        image.save(filepath, "PNG", compress_level=compress_level)
     abs_path = os.path.abspath(filepath)
 
     logger.info(f"Saved image to: {abs_path}")
     return abs_path
 
 
-def get_last_prompt_from_csv(csv_path: str) -> str | None:
+def find_latest_image(directory: str = "generated_images", prefix: str = "landscape") -> Optional[str]:
     """
-    Get the last prompt from a CSV history file.
+    Find the most recent image saved by save_image_with_timestamp.
 
     Args:
-        csv_path: Path to the CSV file
+        directory: Directory to search (default: "generated_images")
+        prefix: Filename prefix (default: "landscape")
 
     Returns:
-        The last prompt string, or None if file doesn't exist or is empty
+        Absolute path of the newest image, or None if there is none
     """
-    if not os.path.exists(csv_path):
+    if not os.path.isdir(directory):
         return None
-
-    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-        if len(rows) > 1 and len(rows[-1]) > 1:  # Has header + at least one entry
-            return rows[-1][1]
-    return None
+    # Timestamped names sort chronologically
+    names = [name for name in os.listdir(directory)
+             if name.startswith(f"{prefix}_") and name.endswith(tuple(f".{fmt}" for fmt in ARCHIVE_FORMATS))]
+    if not names:
+        return None
+    return os.path.abspath(os.path.join(directory, max(names)))
 
 
-def log_prompt_to_csv(
-    prompt: str,
-    csv_path: str = None
-) -> str:
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb', encoding: Optional[str] = None) -> Iterator[IO]:
     """
-    Append prompt with timestamp to CSV history file.
+    Write a file atomically.
 
-    Skips writing if the prompt is identical to the previous entry.
+    Yields a temporary file in the same directory, which replaces path when
+    the block completes; if the block fails it is deleted and path is left
+    untouched. The file gets the usual 0666 & ~umask permissions rather
+    than the owner-only mode of temporary files.
 
     Args:
-        prompt: The prompt text to log
-        csv_path: Path to CSV file (default: prompt_history.csv in project root)
-
-    Returns:
-        Path to the CSV file
+        path: Destination file
+        mode: 'wb' or 'w'
+        encoding: Text encoding for mode 'w'
     """
-    if csv_path is None:
-        csv_path = os.getenv('PROMPT_HISTORY_FILE',
-                            str(Path(__file__).parent / 'prompt_history.csv'))
-
-    file_exists = os.path.exists(csv_path)
-
-    if get_last_prompt_from_csv(csv_path) == prompt:
-        logger.debug(f"Skipping duplicate prompt in CSV")
-        return csv_path
-
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(['timestamp', 'prompt'])
-        writer.writerow([timestamp, prompt])
-
-    logger.info(f"Logged prompt to: {csv_path}")
-    return csv_path
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,242 @@
+"""
+Priority queue of display jobs for the web app.
+
+Generation requests become jobs with an id, a priority and a status. A
+single worker runs them one at a time, so only one job drives the panel,
+while new requests keep being accepted and queued. A request identical to
+one that is still waiting is coalesced into it instead of queued twice.
+"""
+
+import time
+import uuid
+import heapq
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Lower values run first
+PRIORITY_MANUAL = 0
+PRIORITY_SCHEDULED = 10
+
+DEFAULT_HISTORY_SIZE = 50
+
+
+class Job:
+    """One queued, running or finished display job."""
+
+    def __init__(self, kind: str, priority: int, params: Dict[str, Any]):
+        """
+        Initialize job.
+
+        Args:
+            kind: Origin of the job, e.g. 'manual' or 'scheduled'
+            priority: Queue priority, lower runs first
+            params: Arguments for the runner; equal params mark duplicates
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.priority = priority
+        self.params = params
+        self.status = 'queued'  # queued, running, complete, error, cancelled
+        self.message = 'Waiting in queue'
+        self.result: Optional[Dict[str, Any]] = None
+        self.requests = 1
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serializable view of the job."""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'priority': self.priority,
+            'params': self.params,
+            'status': self.status,
+            'message': self.message,
+            'requests': self.requests,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+        }
+
+
+class JobQueue:
+    """Runs jobs one at a time by priority, then submission order."""
+
+    def __init__(
+        self,
+        runner: Callable[[Job, Callable[[str], None]], Awaitable[Dict[str, Any]]],
+        on_change: Optional[Callable[[Job], None]] = None,
+        history_size: int = DEFAULT_HISTORY_SIZE
+    ):
+        """
+        Initialize job queue.
+
+        Args:
+            runner: async runner(job, progress) returning a result dict with
+                'success' and 'message'; progress(message) may be called
+                from any thread
+            on_change: Called with the job after every status or progress
+                change, from the thread making the change
+            history_size: Finished jobs kept for lookup
+        """
+        self._runner = runner
+        self._on_change = on_change
+        self._history_size = history_size
+        self._heap: List[Tuple[int, int, Job]] = []
+        self._seq = 0
+        self._running: Optional[Job] = None
+        self._finished: 'OrderedDict[str, Job]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self) -> asyncio.Task:
+        """Start the worker on the running event loop."""
+        self._wakeup = asyncio.Event()
+        if self._heap:
+            self._wakeup.set()
+        return asyncio.get_running_loop().create_task(self._work())
+
+    def submit(self, kind: str, priority: int, params: Dict[str, Any]) -> Tuple[Job, bool]:
+        """
+        Queue a job, or coalesce it into an identical queued one.
+
+        A coalesced job keeps its place and takes the higher of the two
+        priorities. Call from the event loop.
+
+        Returns:
+            (job, coalesced)
+        """
+        with self._lock:
+            for _, _, job in self._heap:
+                if job.params == params:
+                    job.requests += 1
+                    if priority < job.priority:
+                        job.priority = priority
+                        self._heap = [(queued.priority, seq, queued) for _, seq, queued in self._heap]
+                        heapq.heapify(self._heap)
+                    coalesced = job
+                    break
+            else:
+                coalesced = None
+                job = Job(kind, priority, params)
+                self._seq += 1
+                heapq.heappush(self._heap, (priority, self._seq, job))
+        if coalesced is not None:
+            logger.info(f"Coalesced {kind} request into job {job.id}")
+        else:
+            logger.info(f"Queued {kind} job {job.id}")
+            if self._wakeup is not None:
+                self._wakeup.set()
+        self._changed(job)
+        return job, coalesced is not None
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return a queued, running or recently finished job."""
+        with self._lock:
+            if self._running is not None and self._running.id == job_id:
+                return self._running
+            for _, _, job in self._heap:
+                if job.id == job_id:
+                    return job
+            return self._finished.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a queued or running job. Call from the event loop.
+
+        Returns:
+            False if no such job is queued or running
+        """
+        with self._lock:
+            running = self._running if self._running is not None and self._running.id == job_id else None
+            queued = next((job for _, _, job in self._heap if job.id == job_id), None)
+            if queued is not None:
+                self._heap = [entry for entry in self._heap if entry[2] is not queued]
+                heapq.heapify(self._heap)
+        if running is not None:
+            running.task.cancel()
+            return True
+        if queued is not None:
+            self._finish(queued, 'cancelled', 'Cancelled before it started')
+            return True
+        return False
+
+    def running(self) -> Optional[Job]:
+        """The job currently driving the panel, if any."""
+        with self._lock:
+            return self._running
+
+    def queued(self) -> List[Job]:
+        """Waiting jobs in the order they will run."""
+        with self._lock:
+            return [job for _, _, job in sorted(self._heap)]
+
+    def finished(self) -> List[Job]:
+        """Recently finished jobs, newest first."""
+        with self._lock:
+            return list(reversed(self._finished.values()))
+
+    async def _work(self):
+        while True:
+            await self._wakeup.wait()
+            with self._lock:
+                if not self._heap:
+                    self._wakeup.clear()
+                    continue
+                job = heapq.heappop(self._heap)[2]
+                self._running = job
+            await self._run(job)
+
+    async def _run(self, job: Job):
+        job.status = 'running'
+        job.started = time.time()
+        self._progress(job, 'Starting generation...')
+
+        job.task = asyncio.get_running_loop().create_task(self._runner(job, lambda msg: self._progress(job, msg)))
+        try:
+            result = await job.task
+        except asyncio.CancelledError:
+            logger.info(f"Job {job.id} cancelled")
+            self._finish(job, 'cancelled', 'Generation cancelled')
+            if asyncio.current_task().cancelling():
+                raise  # The worker itself is being cancelled (shutdown)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            self._finish(job, 'error', f'Unexpected error: {str(e)}', {'success': False, 'error': str(e)})
+        else:
+            self._finish(job, 'complete' if result['success'] else 'error', result['message'], result)
+
+    def _progress(self, job: Job, message: str):
+        if job.status != 'running':
+            return  # Late update from a worker thread
+        job.message = message
+        self._changed(job)
+
+    def _finish(self, job: Job, status: str, message: str, result: Optional[Dict[str, Any]] = None):
+        job.status = status
+        job.message = message
+        job.result = result
+        job.finished = time.time()
+        job.task = None
+        with self._lock:
+            if self._running is job:
+                self._running = None
+            self._finished[job.id] = job
+            while len(self._finished) > self._history_size:
+                self._finished.popitem(last=False)
+        self._changed(job)
+
+    def _changed(self, job: Job):
+        if self._on_change is not None:
+            try:
+                self._on_change(job)
+            except Exception as e:
+                logger.warning(f"Job change listener failed: {e}")
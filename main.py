@@ -7,10 +7,16 @@ CLI entry point that uses core.py for generation logic.
 
 import os
 import sys
+import asyncio
+import argparse
 import logging
 from pathlib import Path
+from typing import List
 from dotenv import load_dotenv
-from core import generate_and_display_image
+from core import (generate_and_display_image, display_prefetched_frame, prefetch_frames_async,
+                  generate_batch_async, BATCH_CONCURRENCY)
+import dithering
+from prompt_history import get_prompt_history
 
 
 # Configure logging
@@ -21,9 +27,105 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def refill_prefetch_queue(prompt: str, config: dict):
+    """Prepare frames for the next runs; failures are logged, not fatal."""
+    if config['prefetch_count'] <= 0:
+        return
+    try:
+        added = asyncio.run(prefetch_frames_async(prompt, config))
+        logger.info(f"Prefetched {added} frame(s) for upcoming runs")
+    except Exception as e:
+        logger.warning(f"Prefetch failed, the next run will generate live: {e}")
+
+
+def build_config() -> dict:
+    """Build configuration from environment variables."""
+    return {
+        'api_key': os.getenv("GEMINI_API_KEY"),
+        'model': os.getenv("GEMINI_MODEL", "gemini-2.5-flash-image"),
+        'width': int(os.getenv("EPD_WIDTH", "800")),
+        'height': int(os.getenv("EPD_HEIGHT", "480")),
+        'image_dir': os.getenv("IMAGE_DIR", "generated_images"),
+        'archive_format': os.getenv("ARCHIVE_FORMAT", "png").lower(),
+        'archive_compress_level': int(os.getenv("ARCHIVE_COMPRESS_LEVEL", "6")),
+        'dither': os.getenv("EPD_DITHER", "pil"),
+        'dither_strength': float(os.getenv("EPD_DITHER_STRENGTH", "1.0")),
+        'dither_serpentine': os.getenv("EPD_DITHER_SERPENTINE", "false").lower() == "true",
+        'frame_cache_dir': os.getenv("FRAME_CACHE_DIR"),
+        'frame_cache_size': int(os.getenv("FRAME_CACHE_SIZE", "200")),
+        'early_wake': os.getenv("EPD_EARLY_WAKE", "true").lower() == "true",
+        'prompt_cache_ttl': float(os.getenv("PROMPT_CACHE_TTL", "0")),
+        'prompt_cache_size': int(os.getenv("PROMPT_CACHE_SIZE", "50")),
+        'prompt_cache_dir': os.getenv("PROMPT_CACHE_DIR"),
+        'force_fresh': os.getenv("FORCE_FRESH", "false").lower() == "true",
+        'prefetch_count': int(os.getenv("PREFETCH_COUNT", "0")),
+        'prefetch_dir': os.getenv("PREFETCH_DIR")
+    }
+
+
+def load_batch_prompts(args: argparse.Namespace) -> List[str]:
+    """
+    Read the prompts of a batch run.
+
+    A prompts file has one prompt per line; blank lines and lines starting
+    with '#' are skipped. History prompts are de-duplicated, keeping the
+    most recent occurrence. --limit keeps the last N prompts.
+    """
+    if args.history:
+        entries = get_prompt_history().recent(limit=args.limit or None, unique=True)
+        return [entry['prompt'] for entry in reversed(entries)]
+    lines = Path(args.prompts).read_text(encoding='utf-8').splitlines()
+    prompts = [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+    if args.limit:
+        prompts = prompts[-args.limit:]
+    return prompts
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    """Generate and convert a playlist of frames without using the panel; returns the exit code."""
+    load_dotenv()
+    config = build_config()
+    if args.fresh:
+        config['force_fresh'] = True
+
+    prompts = load_batch_prompts(args)
+    if not prompts:
+        logger.error("No prompts to generate")
+        return 1
+
+    logger.info(f"Batch of {len(prompts)} prompt(s) -> {args.output}")
+    entries = asyncio.run(generate_batch_async(
+        prompts, config, args.output, concurrency=args.concurrency, workers=args.workers))
+    failed = [entry for entry in entries if 'error' in entry]
+    logger.info(f"✓ {len(entries) - len(failed)}/{len(entries)} frames written to {args.output}")
+    return 1 if failed else 0
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments; no subcommand displays one image."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command')
+
+    batch = subparsers.add_parser('batch', help='Generate panel-ready frames offline for a playlist')
+    source = batch.add_mutually_exclusive_group(required=True)
+    source.add_argument('--prompts', metavar='FILE', help='Text file with one prompt per line')
+    source.add_argument('--history', action='store_true', help='Use the prompts from the prompt history')
+    batch.add_argument('--limit', type=int, help='Only use the last N prompts')
+    batch.add_argument('--output', default='playlist', help='Output directory (default: playlist)')
+    batch.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY,
+                       help=f'Concurrent Gemini calls (default: {BATCH_CONCURRENCY})')
+    batch.add_argument('--workers', type=int, help='Conversion processes (default: CPU count)')
+    batch.add_argument('--fresh', action='store_true', help='Bypass the prompt cache')
+    return parser.parse_args()
+
+
 def main():
     """Main CLI entry point."""
+    args = parse_args()
     try:
+        if args.command == 'batch':
+            sys.exit(run_batch(args))
+
         # Load environment variables
         logger.info("Loading environment configuration...")
         load_dotenv()
@@ -42,22 +144,20 @@ def main():
             sys.exit(1)
 
         # Build configuration
-        config = {
-            'api_key': os.getenv("GEMINI_API_KEY"),
-            'model': os.getenv("GEMINI_MODEL", "gemini-2.5-flash-image"),
-            'width': int(os.getenv("EPD_WIDTH", "800")),
-            'height': int(os.getenv("EPD_HEIGHT", "480")),
-            'image_dir': os.getenv("IMAGE_DIR", "generated_images")
-        }
+        config = build_config()
 
         logger.info(f"Configuration loaded - Model: {config['model']}, Resolution: {config['width']}x{config['height']}")
         logger.info(f"Prompt: {prompt[:80]}...")
+        dithering.warm_palette_lut(config['dither'], config['dither_strength'])
 
-        # Generate and display image using core logic
-        result = generate_and_display_image(prompt, config)
+        # Show a frame prepared by an earlier run, else generate one now
+        result = display_prefetched_frame(prompt, config)
+        if result is None:
+            result = generate_and_display_image(prompt, config)
 
         if result['success']:
             logger.info(f"✓ {result['message']}")
+            refill_prefetch_queue(prompt, config)
             sys.exit(0)
         else:
             logger.error(f"✗ {result['message']}")
@@ -0,0 +1,147 @@
+"""
+Precompiled HTML page template with cached, pre-compressed renders.
+
+The template is split once into static segments and {{ name }}
+placeholders and is only re-read when its modification time changes.
+Values are HTML-escaped when inserted. The last render is kept together
+with its ETag and compressed variants, so repeated requests for an
+unchanged page cost a stat() and a lookup.
+"""
+
+import os
+import re
+import gzip
+import html
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = re.compile(r'\{\{\s*([\w.]+)\s*\}\}')
+
+# Content codings in order of preference
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class RenderedPage:
+    """A rendered page, its ETag and lazily built compressed variants."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self._encoded: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def encode(self, encoding: str) -> bytes:
+        """Body in the given content coding ('identity', 'gzip' or 'br')."""
+        if encoding == 'identity':
+            return self.body
+        with self._lock:
+            if encoding not in self._encoded:
+                if encoding == 'br':
+                    self._encoded[encoding] = brotli.compress(self.body, quality=9)
+                else:
+                    self._encoded[encoding] = gzip.compress(self.body, compresslevel=9, mtime=0)
+            return self._encoded[encoding]
+
+    def etag_for(self, encoding: str) -> str:
+        """Strong ETag of one representation; compressed variants get their own."""
+        suffix = '' if encoding == 'identity' else f"-{encoding}"
+        return f'"{self.etag}{suffix}"'
+
+
+class PageTemplate:
+    """HTML template with {{ name }} placeholders, reloaded when the file changes."""
+
+    def __init__(self, path: str):
+        """
+        Initialize page template.
+
+        Args:
+            path: Template file; read on first render
+        """
+        self.path = path
+        self._mtime: Optional[int] = None
+        self._static: List[str] = []
+        self._names: List[str] = []
+        self._last: Optional[Tuple[Tuple[str, ...], RenderedPage]] = None
+        self._lock = threading.Lock()
+
+    def _load_if_changed(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            parts = PLACEHOLDER.split(f.read())
+        # split() alternates static text and captured placeholder names
+        self._static = parts[0::2]
+        self._names = parts[1::2]
+        self._mtime = mtime
+        self._last = None
+        logger.info(f"Loaded page template {self.path} ({len(self._names)} placeholders)")
+
+    def render(self, values: Dict[str, str]) -> RenderedPage:
+        """
+        Render the template, reusing the previous result if nothing changed.
+
+        Args:
+            values: Text for each placeholder name; HTML-escaped on insertion
+
+        Raises:
+            KeyError: If the template uses a name missing from values
+        """
+        with self._lock:
+            self._load_if_changed()
+            key = tuple(str(values[name]) for name in self._names)
+            if self._last is not None and self._last[0] == key:
+                return self._last[1]
+
+            parts = [self._static[0]]
+            for value, static in zip(key, self._static[1:]):
+                parts.append(html.escape(value))
+                parts.append(static)
+            page = RenderedPage(''.join(parts).encode('utf-8'))
+            self._last = (key, page)
+            return page
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> str:
+    """
+    Pick the preferred supported content coding from an Accept-Encoding header.
+
+    Returns:
+        'br', 'gzip' or 'identity'
+    """
+    accepted, refused = set(), set()
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    refused.add(coding)
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding)
+    for encoding in ENCODINGS:
+        # A wildcard never selects a coding the client refused explicitly
+        if encoding not in refused and (encoding in accepted or '*' in accepted):
+            return encoding
+    return 'identity'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag (weak comparison)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
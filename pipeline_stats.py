@@ -0,0 +1,136 @@
+"""
+Per-stage timing of the generate -> display pipeline.
+
+A StageTimer records how long each stage of one run took (monotonic
+clock) and how many bytes it produced; finished runs are added to a
+process-wide rolling histogram so the web app can report where refresh
+time goes. Stage listeners are notified as stages start and finish, e.g.
+to push progress to web clients.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages in execution order
+STAGES = ('validate', 'generate', 'save', 'load', 'prepare', 'quantize', 'pack',
+          'wake', 'transfer', 'refresh', 'sleep')
+
+# Runs kept per stage in the rolling histogram
+HISTORY_SIZE = 100
+
+
+class StageTimer:
+    """Durations and byte counts of the stages of one pipeline run."""
+
+    def __init__(self, run: str = 'display'):
+        """
+        Initialize stage timer.
+
+        Args:
+            run: Kind of run reported to stage listeners, e.g. 'display' or 'prefetch'
+        """
+        self.run = run
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self._start = time.monotonic()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        """
+        Time a stage. The yielded dict is stored as the stage's record, so
+        the block can add fields such as 'bytes'. Failed stages are recorded
+        too.
+        """
+        record: Dict[str, Any] = {}
+        _notify({'run': self.run, 'stage': name, 'state': 'started'})
+        start = time.monotonic()
+        try:
+            yield record
+        finally:
+            self.add(name, time.monotonic() - start, **record)
+
+    def add(self, name: str, seconds: Optional[float], **fields):
+        """Record a stage measured elsewhere (None durations are ignored)."""
+        if seconds is not None:
+            self.stages[name] = dict(fields, ms=round(seconds * 1000, 1))
+            _notify(dict(self.stages[name], run=self.run, stage=name, state='finished'))
+
+    def total_ms(self) -> float:
+        """Milliseconds since the timer was created."""
+        return round((time.monotonic() - self._start) * 1000, 1)
+
+    def summary(self) -> str:
+        """One-line breakdown for logging, e.g. 'generate 8123 ms, refresh 19210 ms'."""
+        return ', '.join(f"{name} {record['ms']:.0f} ms" for name, record in self.stages.items())
+
+
+class StageHistogram:
+    """Rolling window of stage durations across runs."""
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self._durations: Dict[str, Deque[float]] = {}
+        self._size = size
+        self._lock = threading.Lock()
+
+    def record(self, stages: Dict[str, Dict[str, Any]], total_ms: float):
+        """Add the stages and total duration of one run."""
+        with self._lock:
+            for name, ms in [(name, record['ms']) for name, record in stages.items()] + [('total', total_ms)]:
+                self._durations.setdefault(name, deque(maxlen=self._size)).append(ms)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean, p50, p90 and max milliseconds per stage, in pipeline order."""
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self._durations.items()}
+        order = [name for name in STAGES + ('total',) if name in durations]
+        order += sorted(set(durations) - set(order))
+        return {name: {
+            'count': len(durations[name]),
+            'mean_ms': round(sum(durations[name]) / len(durations[name]), 1),
+            'p50_ms': _percentile(durations[name], 0.5),
+            'p90_ms': _percentile(durations[name], 0.9),
+            'max_ms': durations[name][-1],
+        } for name in order}
+
+
+def _percentile(values, fraction: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+_histogram = StageHistogram()
+_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_stage_listener(listener: Callable[[Dict[str, Any]], None]) -> None:
+    """
+    Call listener(event) whenever a stage of any run starts or finishes.
+
+    Events are dicts with 'run', 'stage' and 'state' ('started' or
+    'finished'; finished events add 'ms' and the stage's fields). Listeners
+    run on the thread executing the stage and must not block.
+    """
+    _listeners.append(listener)
+
+
+def _notify(event: Dict[str, Any]):
+    for listener in list(_listeners):
+        try:
+            listener(event)
+        except Exception as e:
+            logger.warning(f"Stage listener failed: {e}")
+
+
+def record_run(timer: StageTimer) -> None:
+    """Add a finished run to the process-wide histogram."""
+    _histogram.record(timer.stages, timer.total_ms())
+
+
+def get_stage_stats() -> Dict[str, Dict[str, float]]:
+    """Rolling per-stage timing summary of recent runs."""
+    return _histogram.summary()
@@ -0,0 +1,131 @@
+"""
+Bounded on-disk queue of pre-generated, ready-to-push panel frames.
+
+Each entry is a packed panel buffer plus JSON metadata (prompt, conversion
+parameters, source image path). Frames are generated and converted ahead of
+time so a scheduled refresh only has to transfer the buffer to the panel.
+"""
+
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from image_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchQueue:
+    """FIFO of prepared frames, stored as <seq>.epd + <seq>.json pairs."""
+
+    def __init__(self, directory: str, capacity: int):
+        """
+        Initialize prefetch queue.
+
+        Args:
+            directory: Queue directory (created on first write)
+            capacity: Maximum number of queued frames
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    def _sequences(self):
+        if not os.path.isdir(self.directory):
+            return []
+        # The .json file is written last and marks a complete entry
+        return sorted(int(name[:-5]) for name in os.listdir(self.directory)
+                      if name.endswith('.json') and name[:-5].isdigit())
+
+    def _paths(self, seq: int) -> Tuple[str, str]:
+        base = os.path.join(self.directory, f"{seq:08d}")
+        return base + '.epd', base + '.json'
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sequences())
+
+    def is_full(self) -> bool:
+        return len(self) >= self.capacity
+
+    def push(self, buffer: bytes, metadata: Dict[str, Any]) -> bool:
+        """
+        Append a prepared frame.
+
+        Returns:
+            False if the queue is full
+        """
+        with self._lock:
+            sequences = self._sequences()
+            if len(sequences) >= self.capacity:
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            seq = sequences[-1] + 1 if sequences else 0
+            buffer_path, meta_path = self._paths(seq)
+            metadata = dict(metadata, queued_at=datetime.now().isoformat(timespec='seconds'))
+            with atomic_write(buffer_path) as f:
+                f.write(buffer)
+            with atomic_write(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(metadata, f)
+            logger.info(f"Queued prefetched frame {seq} ({len(sequences) + 1}/{self.capacity})")
+            return True
+
+    def pop(self, match: Optional[Dict[str, Any]] = None) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        """
+        Remove and return the oldest frame.
+
+        Args:
+            match: Metadata values the frame must have (e.g. prompt and
+                conversion parameters); older frames that differ are discarded
+
+        Returns:
+            (buffer, metadata), or None if no matching frame is queued
+        """
+        with self._lock:
+            for seq in self._sequences():
+                buffer_path, meta_path = self._paths(seq)
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        metadata = json.load(f)
+                    with open(buffer_path, 'rb') as f:
+                        buffer = f.read()
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Dropping unreadable prefetched frame {seq}: {e}")
+                    buffer = metadata = None
+                finally:
+                    for path in (meta_path, buffer_path):
+                        try:
+                            os.unlink(path)
+                        except FileNotFoundError:
+                            pass
+
+                if metadata is None:
+                    continue
+                if match and any(metadata.get(k) != v for k, v in match.items()):
+                    logger.info(f"Discarding stale prefetched frame {seq}")
+                    continue
+                return buffer, metadata
+            return None
+
+
+_queues: Dict[str, PrefetchQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(directory: str, capacity: int) -> PrefetchQueue:
+    """
+    Return the process-wide queue for directory, creating it on first use so
+    producers and consumers of the same directory share one lock.
+
+    The capacity of an existing queue is updated to the given value.
+    """
+    with _queues_lock:
+        key = os.path.abspath(directory)
+        queue = _queues.get(key)
+        if queue is None:
+            queue = PrefetchQueue(directory, capacity)
+            _queues[key] = queue
+        queue.capacity = capacity
+        return queue
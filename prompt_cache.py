@@ -0,0 +1,155 @@
+"""
+Cache of generated images keyed by prompt and model.
+
+Maps the final prompt sent to Gemini plus the model name to the encoded
+image the API returned, so repeating a prompt skips the network call.
+Images are stored content-addressed (named by their SHA-256), identical
+results share one file, and an index tracks creation times for TTL and
+size-bounded eviction.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+from typing import Any, Dict, Optional
+from image_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 50
+
+INDEX_FILE = 'index.json'
+
+# Names of the image files the cache owns: <sha256 hex><extension>
+CACHE_FILE = re.compile(r'[0-9a-f]{64}\.\w+')
+
+
+def prompt_key(prompt: str, model: str) -> str:
+    """Hex SHA-256 of the final prompt and model name."""
+    return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+
+class PromptCache:
+    """TTL- and size-bounded prompt -> image cache with content-addressed storage."""
+
+    def __init__(self, directory: str, ttl: float, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Initialize prompt cache.
+
+        Args:
+            directory: Directory holding the images and the index (created on first write)
+            ttl: Seconds an entry stays valid
+            max_entries: Entries kept before the oldest ones are evicted
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached image bytes for key, or None on a miss or expiry."""
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry['created'] >= self.ttl:
+                logger.info(f"Prompt cache entry expired: {key[:12]}")
+                del index[key]
+                self._save_index(index)
+                return None
+            try:
+                with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                del index[key]
+                self._save_index(index)
+                return None
+        logger.info(f"Prompt cache hit: {key[:12]} -> {entry['file']}")
+        return data
+
+    def put(self, key: str, data: bytes, mime_type: Optional[str] = None) -> str:
+        """
+        Store image bytes for key and evict expired and surplus entries.
+
+        Returns:
+            Absolute path of the content-addressed image file
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        extension = (mimetypes.guess_extension(mime_type) if mime_type else None) or '.img'
+        filename = digest + extension
+        path = os.path.join(self.directory, filename)
+
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if not os.path.exists(path):
+                with atomic_write(path) as f:
+                    f.write(data)
+            index = self._load_index()
+            index[key] = {'file': filename, 'created': time.time()}
+            self._evict(index)
+            self._save_index(index)
+        logger.debug(f"Prompt cache stored: {key[:12]} -> {filename}")
+        return os.path.abspath(path)
+
+    def _evict(self, index: Dict[str, Any]):
+        now = time.time()
+        for key in [k for k, entry in index.items() if now - entry['created'] >= self.ttl]:
+            del index[key]
+        oldest_first = sorted(index, key=lambda k: index[k]['created'])
+        for key in oldest_first[:max(0, len(index) - self.max_entries)]:
+            del index[key]
+
+        # Delete image files no remaining entry refers to. The directory may be
+        # shared (e.g. IMAGE_DIR), so only the cache's own file names count.
+        referenced = {entry['file'] for entry in index.values()}
+        for entry in os.scandir(self.directory):
+            if (CACHE_FILE.fullmatch(entry.name) and entry.name not in referenced
+                    and entry.is_file(follow_symlinks=False)):
+                try:
+                    os.unlink(entry.path)
+                    logger.debug(f"Prompt cache evicted: {entry.name}")
+                except FileNotFoundError:
+                    pass
+
+    def _load_index(self) -> Dict[str, Any]:
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read prompt cache index {path}: {e}")
+            return {}
+
+    def _save_index(self, index: Dict[str, Any]):
+        with atomic_write(os.path.join(self.directory, INDEX_FILE), 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+
+
+_caches: Dict[str, PromptCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_prompt_cache(directory: str, ttl: float, max_entries: int = DEFAULT_MAX_ENTRIES) -> PromptCache:
+    """
+    Return the process-wide cache for directory, creating it on first use so
+    every reader and writer of its index shares one lock.
+
+    The TTL and size limit of an existing cache are updated to the given values.
+    """
+    with _caches_lock:
+        key = os.path.abspath(directory)
+        cache = _caches.get(key)
+        if cache is None:
+            cache = PromptCache(directory, ttl, max_entries)
+            _caches[key] = cache
+        cache.ttl = ttl
+        cache.max_entries = max_entries
+        return cache
@@ -0,0 +1,137 @@
+"""
+Append-only prompt history.
+
+Prompts are stored in a SQLite database in WAL mode, so saving a prompt
+and reading the latest entries touch only the end of the table instead of
+re-reading a CSV file. Entries are read newest first by walking the rowid
+backwards, which keeps limit/offset/search queries proportional to the
+rows returned (plus skipped and non-matching rows) rather than to the
+size of the history. An existing prompt_history.csv is imported once when
+the database is created.
+"""
+
+import os
+import csv
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class PromptHistory:
+    """SQLite-backed prompt history, newest entries first."""
+
+    def __init__(self, path: str, legacy_csv: Optional[str] = None):
+        """
+        Initialize prompt history, creating the database if needed.
+
+        Args:
+            path: SQLite database file
+            legacy_csv: CSV history (timestamp,prompt) imported when the
+                database is first created
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                with conn:
+                    conn.execute("CREATE TABLE IF NOT EXISTS prompts ("
+                                 "id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, prompt TEXT NOT NULL)")
+                    if legacy_csv and os.path.exists(legacy_csv):
+                        self._import_csv(conn, legacy_csv)
+                    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _import_csv(conn: sqlite3.Connection, csv_path: str):
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            rows = [(row['timestamp'], row['prompt']) for row in csv.DictReader(f) if row.get('prompt')]
+        conn.executemany("INSERT INTO prompts (timestamp, prompt) VALUES (?, ?)", rows)
+        logger.info(f"Imported {len(rows)} prompt(s) from {csv_path}")
+
+    def add(self, prompt: str) -> bool:
+        """
+        Append a prompt with the current time.
+
+        Skips writing if the prompt is identical to the previous entry.
+
+        Returns:
+            True if an entry was added
+        """
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+        # The lock makes check-and-insert atomic within the process
+        with self._lock, closing(self._connect()) as conn, conn:
+            last = conn.execute("SELECT prompt FROM prompts ORDER BY id DESC LIMIT 1").fetchone()
+            if last is not None and last['prompt'] == prompt:
+                logger.debug("Skipping duplicate prompt in history")
+                return False
+            conn.execute("INSERT INTO prompts (timestamp, prompt) VALUES (?, ?)", (timestamp, prompt))
+        logger.info(f"Logged prompt to: {self.path}")
+        return True
+
+    def recent(self, limit: Optional[int] = 3, offset: int = 0, search: Optional[str] = None,
+               unique: bool = False) -> List[Dict[str, object]]:
+        """
+        Return history entries, newest first.
+
+        Args:
+            limit: Maximum number of entries (None for all)
+            offset: Matching entries to skip (for paging)
+            search: Only entries whose prompt contains this text (case-insensitive
+                for ASCII letters)
+            unique: Only the most recent entry of each distinct prompt
+
+        Returns:
+            List of {'id': int, 'timestamp': str, 'prompt': str}
+        """
+        where, params = '', []
+        if search:
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where = "WHERE prompt LIKE ? ESCAPE '\\'"
+            params.append(f"%{escaped}%")
+        if unique:
+            # Latest id per prompt; scans the history, unlike the plain query
+            query = (f"SELECT id, timestamp, prompt FROM prompts WHERE id IN "
+                     f"(SELECT MAX(id) FROM prompts {where} GROUP BY prompt) "
+                     f"ORDER BY id DESC LIMIT ? OFFSET ?")
+        else:
+            query = f"SELECT id, timestamp, prompt FROM prompts {where} ORDER BY id DESC LIMIT ? OFFSET ?"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params + [-1 if limit is None else max(0, limit), max(0, offset)]).fetchall()
+        return [dict(row) for row in rows]
+
+
+_history: Optional[PromptHistory] = None
+_history_lock = threading.Lock()
+
+
+def get_prompt_history() -> PromptHistory:
+    """
+    Return the process-wide prompt history, opening it on first use.
+
+    The database path is read from PROMPT_HISTORY_DB (default:
+    prompt_history.db in the project root); the CSV named by
+    PROMPT_HISTORY_FILE (default: prompt_history.csv) is imported once.
+    """
+    global _history
+    with _history_lock:
+        if _history is None:
+            root = Path(__file__).parent
+            _history = PromptHistory(
+                os.getenv('PROMPT_HISTORY_DB', str(root / 'prompt_history.db')),
+                legacy_csv=os.getenv('PROMPT_HISTORY_FILE', str(root / 'prompt_history.csv')))
+        return _history
@@ -0,0 +1,141 @@
+"""
+Retry policy and circuit breaker for calls to remote services.
+
+The retry policy bounds each attempt with a deadline and spaces retries
+with jittered exponential backoff. The circuit breaker stops calling a
+service after repeated failures and lets a single trial call through once
+its reset timeout has passed.
+"""
+
+import time
+import random
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceUnavailableError(Exception):
+    """A remote service failed after all retries."""
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """The circuit breaker is open; the call was not attempted."""
+
+
+class RetryPolicy:
+    """Attempt limit, per-attempt deadline and backoff schedule."""
+
+    def __init__(self, max_attempts: int = 3, timeout: float = 60.0,
+                 backoff: float = 2.0, max_backoff: float = 30.0):
+        """
+        Initialize retry policy.
+
+        Args:
+            max_attempts: Attempts per call, including the first
+            timeout: Deadline of a single attempt in seconds
+            backoff: Delay before the first retry in seconds, doubled per retry
+            max_backoff: Upper bound of the retry delay in seconds
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int) -> float:
+        """
+        Seconds to wait after a failed attempt (1-based).
+
+        Uses equal jitter: half the exponential delay plus a random share of
+        the other half, so concurrent callers do not retry in lockstep.
+        """
+        ceiling = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed -> open -> half-open)."""
+
+    CLOSED = 'closed'        # Calls pass through
+    OPEN = 'open'            # Calls fail fast until the reset timeout passes
+    HALF_OPEN = 'half-open'  # One trial call decides whether to close again
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 300.0):
+        """
+        Initialize circuit breaker.
+
+        Args:
+            failure_threshold: Consecutive failed calls that open the circuit
+            reset_timeout: Seconds the circuit stays open before a trial call
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_started: Optional[float] = None
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def before_call(self) -> None:
+        """
+        Check whether a call may proceed.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or a half-open trial
+                call is already in flight
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+                logger.info("Circuit half-open, allowing a trial call")
+                self._state = self.HALF_OPEN
+                self._trial_started = None
+            if self._state == self.HALF_OPEN:
+                # A trial abandoned without a result (e.g. cancelled) expires
+                if self._trial_started is None or now - self._trial_started >= self.reset_timeout:
+                    self._trial_started = now
+                    return
+            if self._state != self.CLOSED:
+                self._rejected += 1
+                retry_in = max(0.0, self.reset_timeout - (now - (self._opened_at or now)))
+                raise CircuitOpenError(f"Circuit open after {self._failures} consecutive failures, "
+                                       f"next trial in {retry_in:.0f} s")
+
+    def record_success(self) -> None:
+        """Close the circuit and reset the failure count."""
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._trial_started = None
+
+    def record_failure(self) -> None:
+        """Count a failed call; opens the circuit at the threshold or on a failed trial."""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Circuit opened after {self._failures} consecutive failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_started = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state, failure count and number of rejected calls."""
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'rejected': self._rejected,
+            }